@@ -1,28 +1,54 @@
 import os
+import shutil
 import tempfile
+import hashlib
 from pathlib import Path
 from loguru import logger
 import streamlit as st
 from src.document_processor import DocumentProcessor
-from src.utils import create_streaming_chat_completion, validate_sambanova_setup
-from src.vector_store import VectorStore
+from src.utils import (
+    create_streaming_chat_completion,
+    validate_sambanova_setup,
+    get_bert_tokenizer,
+    get_token_offsets,
+    create_document_splits,
+    iterate_async
+)
+from src.vector_store import VectorStore, create_qdrant_client
 import datetime
-import json
+import orjson
 import numpy as np
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
 from qdrant_client.http.models import Distance, VectorParams, HnswConfigDiff
 
-class NumpyEncoder(json.JSONEncoder):
-    """Custom JSON encoder for numpy types"""
-    def default(self, obj):
-        if isinstance(obj, np.ndarray):
-            return obj.tolist()
-        if isinstance(obj, np.integer):
-            return int(obj)
-        if isinstance(obj, np.floating):
-            return float(obj)
-        return super().default(obj)
+@st.cache_resource
+def _qdrant_client() -> QdrantClient:
+    """Process-wide Qdrant client shared by every VectorStore"""
+    return create_qdrant_client()
+
+@st.cache_resource
+def _document_processor() -> DocumentProcessor:
+    """Process-wide document processor"""
+    return DocumentProcessor()
+
+@st.cache_data(show_spinner=False)
+def _split_document(doc_hash: str, _content: str, _token_starts, max_chunk_size: int) -> list:
+    """Split document text into token-bounded splits, once per document and split size"""
+    return create_document_splits(_content, _token_starts, max_chunk_size)
+
+@st.cache_resource(show_spinner="Embedding split...", max_entries=8, ttl=3600)
+def _vector_store_for_split(split_key: str, split_content: str) -> VectorStore:
+    """Build and process a VectorStore for one document split, once per split.
+
+    Stores share the process-wide BERT model and Qdrant client, so each cached
+    entry only holds the split's chunks, codebooks and PQ codes. The split's
+    vectors are uploaded to a collection of its own on request, so nothing is
+    written to the shared chunk collection here.
+    """
+    vector_store = VectorStore(client=_qdrant_client())
+    vector_store.process_document(split_content, store=False)
+    return vector_store
 
 class StreamlitApp:
     def __init__(self):
@@ -33,6 +59,8 @@ class StreamlitApp:
         # Initialize session state
         if 'doc_content' not in st.session_state:
             st.session_state.doc_content = None
+        if 'doc_hash' not in st.session_state:
+            st.session_state.doc_hash = None
         if 'doc_name' not in st.session_state:
             st.session_state.doc_name = None
         if 'api_validated' not in st.session_state:
@@ -70,8 +98,10 @@ class StreamlitApp:
             if uploaded_file and st.button("Generate Visualization"):
                 with st.spinner("Creating document visualization..."):
                     try:
-                        st.session_state.vector_store = VectorStore()
-                        chunks, _ = st.session_state.vector_store.process_document(st.session_state.doc_content)
+                        st.session_state.vector_store = VectorStore(client=_qdrant_client())
+                        chunks, _ = st.session_state.vector_store.process_document(
+                            st.session_state.doc_content, store=False
+                        )
                         st.session_state.embedding_fig = st.session_state.vector_store.create_interactive_graph()
                         st.success("Visualization created!")
                     except Exception as e:
@@ -99,52 +129,34 @@ class StreamlitApp:
                         try:
                             # First ensure we have processed the document
                             if not hasattr(st.session_state.vector_store, 'chunks') or not st.session_state.vector_store.chunks:
-                                chunks, _ = st.session_state.vector_store.process_document(st.session_state.doc_content)
+                                chunks, _ = st.session_state.vector_store.process_document(
+                                    st.session_state.doc_content, store=False
+                                )
                             else:
                                 chunks = st.session_state.vector_store.chunks
                             
-                            # Create collection with correct vector configuration
-                            st.session_state.vector_store.client.recreate_collection(
-                                collection_name=collection_name,
-                                vectors_config={
-                                    "vectors": {
-                                        "size": 768,
-                                        "distance": "Cosine"
-                                    }
-                                }
-                            )
+                            # Create collection with HNSW indexing deferred until the upload is done
+                            st.session_state.vector_store.create_bulk_collection(collection_name)
                             
-                            # Reconstruct full vectors from PQ codes
-                            reconstructed_vectors = []
-                            for pq_code in st.session_state.vector_store.pq_codes:
-                                vector = np.zeros(768)  # Full BERT vector size
-                                for i, (code, codebook) in enumerate(zip(pq_code, st.session_state.vector_store.codebooks)):
-                                    start_idx = i * st.session_state.vector_store.segment_size
-                                    end_idx = start_idx + st.session_state.vector_store.segment_size
-                                    vector[start_idx:end_idx] = codebook.cluster_centers_[code]
-                                reconstructed_vectors.append(vector)
+                            # Reconstruct full 768-dim vectors from PQ codes
+                            reconstructed_vectors = st.session_state.vector_store.reconstruct_vectors()
                             
-                            # Store vectors in the collection
-                            points = []
-                            for i, (vector, chunk_text) in enumerate(zip(reconstructed_vectors, chunks)):
-                                points.append({
-                                    "id": i,
-                                    "vector": {
-                                        "vectors": vector.tolist()  # Full 768-dim vector
-                                    },
-                                    "payload": {
-                                        "chunk_index": i,
-                                        "text": chunk_text,  # Include the chunk text
-                                        "document_name": st.session_state.doc_name,
-                                        "timestamp": datetime.datetime.now().isoformat()
-                                    }
-                                })
+                            # Store vectors in the collection; every point shares one ingest timestamp
+                            document_name = st.session_state.doc_name
+                            timestamp = datetime.datetime.now().isoformat()
+                            payloads = [
+                                {
+                                    "chunk_index": i,
+                                    "text": chunk_text,  # Include the chunk text
+                                    "document_name": document_name,
+                                    "timestamp": timestamp
+                                }
+                                for i, chunk_text in enumerate(chunks)
+                            ]
                             
-                            # Upload points to the collection
-                            st.session_state.vector_store.client.upsert(
-                                collection_name=collection_name,
-                                points=points
-                            )
+                            # Upload straight from the float32 matrix of full 768-dim vectors
+                            st.session_state.vector_store.bulk_upload(collection_name, reconstructed_vectors, payloads)
+                            st.session_state.vector_store.build_index(collection_name)
                             
                             st.success("✅ Vectors stored in Qdrant")
                             with st.expander("Qdrant Collection Details"):
@@ -179,9 +191,8 @@ class StreamlitApp:
                             "document_name": st.session_state.doc_name,
                             "document_content": st.session_state.doc_content,
                             "chunks": chunks,  # Add actual chunks
-                            "pq_codes": st.session_state.vector_store.pq_codes.tolist(),
-                            "codebooks": [codebook.cluster_centers_.tolist() 
-                                        for codebook in st.session_state.vector_store.codebooks],
+                            "pq_codes": np.ascontiguousarray(np.asarray(st.session_state.vector_store.pq_codes).T),  # one row per chunk
+                            "codebooks": st.session_state.vector_store.codebook_tensor,
                             "metadata": {
                                 "n_segments": st.session_state.vector_store.n_segments,
                                 "n_clusters": st.session_state.vector_store.n_clusters,
@@ -225,7 +236,7 @@ class StreamlitApp:
                         
                         st.download_button(
                             "📥 Download Processed Vectors",
-                            data=json.dumps(vector_data, cls=NumpyEncoder),
+                            data=orjson.dumps(vector_data, option=orjson.OPT_SERIALIZE_NUMPY),
                             file_name=default_filename,
                             mime="application/json"
                         )
@@ -281,21 +292,9 @@ class StreamlitApp:
                     {"role": "user", "content": query}
                 ]
             
-            # Create placeholder for streaming output
-            response_container = st.empty()
-            stats_container = st.empty()
-            full_response = ""
-            
-            # Stream the response
-            for chunk in create_streaming_chat_completion(messages):
-                if isinstance(chunk, dict) and 'id' in chunk:
-                    st.session_state.last_response_id = chunk['id']
-                elif isinstance(chunk, str):
-                    full_response += chunk
-                    response_container.markdown(full_response + "▌")
-            
-            # Final update without cursor
-            response_container.markdown(full_response)
+            # Stream the response; write_stream accumulates the chunks and renders the final text
+            full_response = st.write_stream(iterate_async(create_streaming_chat_completion(messages)))
+            return full_response
             
         except Exception as e:
             st.error(f"Error processing query: {str(e)}")
@@ -309,23 +308,25 @@ class StreamlitApp:
                 
             # Save uploaded file
             file_path = os.path.join(self.temp_dir, uploaded_file.name)
+            uploaded_file.seek(0)
             with open(file_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
+                # Copy through a fixed 1 MiB buffer rather than materializing the whole file again
+                shutil.copyfileobj(uploaded_file, f, length=1 << 20)
             
             logger.info(f"Saved file to: {file_path}")
             
             # Process the document content
-            processor = DocumentProcessor()
-            content = processor.extract_text(file_path)
+            content = _document_processor().extract_text(file_path)
             
-            # Calculate total tokens when document is loaded
-            from transformers import BertTokenizer
-            tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
-            total_tokens = len(tokenizer.encode(content))
+            # Tokenize once when the document is loaded; splits slice these token offsets
+            token_starts = get_token_offsets(content, get_bert_tokenizer())[:, 0].astype(np.int32)
+            total_tokens = len(token_starts)
             
             # Store in session state
             st.session_state.doc_content = content
+            st.session_state.doc_hash = hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
             st.session_state.total_tokens = total_tokens
+            st.session_state.token_starts = token_starts
             logger.info(f"Processed document content: {len(content)} characters, {total_tokens} tokens")
             
             return True
@@ -441,8 +442,6 @@ class StreamlitApp:
             return
             
         try:
-            from transformers import BertTokenizer
-            tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
             total_tokens = st.session_state.total_tokens
             
             # Add max token size input
@@ -456,51 +455,10 @@ class StreamlitApp:
             )
             
             # Calculate splits based on actual token counts, not character estimates
-            doc_content = st.session_state.doc_content
-            splits = []
-            current_position = 0
-            
-            while current_position < len(doc_content):
-                # Find a chunk that fits within token limit
-                chunk_size = 1000  # Start with small chunk and grow
-                current_chunk = doc_content[current_position:current_position + chunk_size]
-                current_tokens = len(tokenizer.encode(current_chunk))
-                
-                # Binary search for optimal chunk size
-                min_size = 0
-                max_size = len(doc_content) - current_position
-                
-                while min_size < max_size:
-                    mid_size = (min_size + max_size + 1) // 2
-                    test_chunk = doc_content[current_position:current_position + mid_size]
-                    tokens = len(tokenizer.encode(test_chunk))
-                    
-                    if tokens <= max_chunk_size:
-                        min_size = mid_size
-                        chunk_size = mid_size
-                        current_chunk = test_chunk
-                        current_tokens = tokens
-                    else:
-                        max_size = mid_size - 1
-                
-                # Find natural break point
-                if current_position + chunk_size < len(doc_content):
-                    break_chars = ["\n\n", "\n", ". ", " "]
-                    for break_char in break_chars:
-                        natural_break = current_chunk.rfind(break_char)
-                        if natural_break != -1:
-                            chunk_size = natural_break + len(break_char)
-                            current_chunk = doc_content[current_position:current_position + chunk_size]
-                            current_tokens = len(tokenizer.encode(current_chunk))
-                            break
-                
-                splits.append({
-                    "start": current_position,
-                    "end": current_position + chunk_size,
-                    "tokens": current_tokens,
-                    "content": current_chunk
-                })
-                current_position += chunk_size
+            splits = _split_document(
+                st.session_state.doc_hash, st.session_state.doc_content,
+                st.session_state.token_starts, max_chunk_size
+            )
             
             # Display analysis
             num_splits = len(splits)
@@ -513,120 +471,112 @@ class StreamlitApp:
             
             st.markdown("### Document Splits")
             for i, split in enumerate(splits, 1):
-                preview = split["content"][:100] + "..."
-                split_content = split["content"]
-                
-                # Initialize session state for each split
-                if f'vector_store_split_{i}' not in st.session_state:
-                    st.session_state[f'vector_store_split_{i}'] = None
-                if f'embedding_fig_split_{i}' not in st.session_state:
-                    st.session_state[f'embedding_fig_split_{i}'] = None
-                
-                with st.expander(f"Split {i} of {num_splits}"):
-                    st.text(preview)
-                    st.markdown(f"""
-                    - Characters: {len(split_content):,}
-                    - Tokens: {split['tokens']:,}
-                    - Percentage of Max Size: {(split['tokens'] / max_chunk_size) * 100:.1f}%
-                    """)
-                    
-                    # Add save options in columns
-                    save_col1, save_col2 = st.columns(2)
-                    
-                    with save_col1:
-                        collection_name = st.text_input(
-                            "Collection Name",
-                            value=f"split_{i}_chunks",
-                            key=f"collection_{i}",
-                            help="Enter a name for the Qdrant collection"
-                        )
-                        
-                        if st.button("Save to DB", key=f"qdrant_{i}"):
-                            with st.spinner("Storing in Qdrant..."):
-                                try:
-                                    # Use or initialize vector store for this split
-                                    if st.session_state[f'vector_store_split_{i}'] is None:
-                                        st.session_state[f'vector_store_split_{i}'] = VectorStore()
-                                        # Process only this split's content
-                                        chunks, _ = st.session_state[f'vector_store_split_{i}'].process_document(split_content)
-                                    
-                                    vector_store = st.session_state[f'vector_store_split_{i}']
-                                    
-                                    # Create collection with correct vector configuration
-                                    vector_store.client.recreate_collection(
-                                        collection_name=collection_name,
-                                        vectors_config={
-                                            "vectors": {
-                                                "size": 768,
-                                                "distance": "Cosine"
-                                            }
-                                        }
-                                    )
-                                    
-                                    # Store vectors in the collection
-                                    points = []
-                                    for j, (vector, chunk_text) in enumerate(zip(vector_store.pq_codes, vector_store.chunks)):
-                                        points.append({
-                                            "id": j,
-                                            "vector": {
-                                                "vectors": vector.tolist()
-                                            },
-                                            "payload": {
-                                                "chunk_index": j,
-                                                "text": chunk_text,
-                                                "document_name": f"{st.session_state.doc_name}_split_{i}",
-                                                "split_number": i,
-                                                "total_splits": num_splits,
-                                                "timestamp": datetime.datetime.now().isoformat()
-                                            }
-                                        })
-                                    
-                                    vector_store.client.upsert(
-                                        collection_name=collection_name,
-                                        points=points
-                                    )
-                                    st.success("✅ Vectors stored in Qdrant")
-                                except Exception as e:
-                                    st.error(f"❌ Failed to store vectors: {str(e)}")
-                    
-                    with save_col2:
-                        if st.button("Save as JSON", key=f"json_{i}"):
-                            try:
-                                # Use or initialize vector store for this split
-                                if st.session_state[f'vector_store_split_{i}'] is None:
-                                    st.session_state[f'vector_store_split_{i}'] = VectorStore()
-                                    # Process only this split's content
-                                    chunks, _ = st.session_state[f'vector_store_split_{i}'].process_document(split_content)
-                                
-                                vector_store = st.session_state[f'vector_store_split_{i}']
-                                
-                                timestamp = datetime.datetime.now()
-                                output_file = f"data/vectors_split_{i}_{timestamp.strftime('%Y%m%d_%H%M%S')}.json"
-                                
-                                with open(output_file, 'w') as f:
-                                    json.dump({
-                                        "schema_version": "1.0",
-                                        "timestamp": timestamp.isoformat(),
-                                        "split_info": {
-                                            "split_number": i,
-                                            "total_splits": num_splits,
-                                            "token_count": split['tokens'],
-                                            "max_token_size": max_chunk_size,
-                                            "start_char": split["start"],
-                                            "end_char": split["end"]
-                                        },
-                                        "document_name": f"{st.session_state.doc_name}_split_{i}",
-                                        "document_content": split_content,
-                                        "vectors": [v.tolist() for v in vector_store.pq_codes]
-                                    }, f)
-                                
-                                st.success(f"✅ Saved to {output_file}")
-                            except Exception as e:
-                                st.error(f"❌ Failed to save JSON: {str(e)}")
-                            
+                self._render_split(i, split, num_splits, max_chunk_size)
+            
         except Exception as e:
             st.error(f"Error in document split analysis: {str(e)}")
 
+    @st.fragment
+    def _render_split(self, i, split, num_splits, max_chunk_size):
+        """Render a single document split.
+
+        Runs as a fragment so widget interactions inside one split only rerun
+        that split instead of the whole page.
+        """
+        preview = split["content"][:100] + "..."
+        split_content = split["content"]
+        
+        # Initialize session state for each split
+        if f'embedding_fig_split_{i}' not in st.session_state:
+            st.session_state[f'embedding_fig_split_{i}'] = None
+        
+        with st.expander(f"Split {i} of {num_splits}"):
+            st.text(preview)
+            st.markdown(f"""
+            - Characters: {len(split_content):,}
+            - Tokens: {split['tokens']:,}
+            - Percentage of Max Size: {(split['tokens'] / max_chunk_size) * 100:.1f}%
+            """)
+            
+            # Add save options in columns
+            save_col1, save_col2 = st.columns(2)
+            
+            with save_col1:
+                collection_name = st.text_input(
+                    "Collection Name",
+                    value=f"split_{i}_chunks",
+                    key=f"collection_{i}",
+                    help="Enter a name for the Qdrant collection"
+                )
+                
+                if st.button("Save to DB", key=f"qdrant_{i}"):
+                    with st.spinner("Storing in Qdrant..."):
+                        try:
+                            vector_store = _vector_store_for_split(f"{st.session_state.doc_name}_{i}", split_content)
+                            
+                            # Create collection with HNSW indexing deferred until the upload is done
+                            vector_store.create_bulk_collection(collection_name)
+                            
+                            # Store vectors in the collection; the collection holds
+                            # full 768-dim vectors, so decode the PQ codes first
+                            document_name = f"{st.session_state.doc_name}_split_{i}"
+                            timestamp = datetime.datetime.now().isoformat()
+                            payloads = [
+                                {
+                                    "chunk_index": j,
+                                    "text": chunk_text,
+                                    "document_name": document_name,
+                                    "split_number": i,
+                                    "total_splits": num_splits,
+                                    "timestamp": timestamp
+                                }
+                                for j, chunk_text in enumerate(vector_store.chunks)
+                            ]
+                            
+                            vector_store.bulk_upload(collection_name, vector_store.reconstruct_vectors(), payloads)
+                            vector_store.build_index(collection_name)
+                            st.success("✅ Vectors stored in Qdrant")
+                        except Exception as e:
+                            st.error(f"❌ Failed to store vectors: {str(e)}")
+            
+            with save_col2:
+                if st.button("Save as JSON", key=f"json_{i}"):
+                    try:
+                        vector_store = _vector_store_for_split(f"{st.session_state.doc_name}_{i}", split_content)
+                        
+                        timestamp = datetime.datetime.now()
+                        output_stem = f"data/vectors_split_{i}_{timestamp.strftime('%Y%m%d_%H%M%S')}"
+                        vectors_file = f"{output_stem}.npz"
+                        output_file = f"{output_stem}.json"
+                        
+                        # Vectors go to a compressed binary file; the JSON sidecar keeps only metadata.
+                        # PQ codes are cluster ids below n_clusters, so uint8 holds them losslessly;
+                        # the store keeps them per segment, the file one row per chunk.
+                        np.savez_compressed(vectors_file, vectors=np.asarray(vector_store.pq_codes, dtype=np.uint8).T)
+                        
+                        payload = {
+                            "schema_version": "2.0",
+                            "timestamp": timestamp.isoformat(),
+                            "split_info": {
+                                "split_number": i,
+                                "total_splits": num_splits,
+                                "token_count": split['tokens'],
+                                "max_token_size": max_chunk_size,
+                                "start_char": split["start"],
+                                "end_char": split["end"]
+                            },
+                            "document_name": f"{st.session_state.doc_name}_split_{i}",
+                            "document_content": split_content,
+                            "vectors_file": os.path.basename(vectors_file)
+                        }
+                        
+                        with open(output_file, 'wb') as f:
+                            f.write(orjson.dumps(payload, option=orjson.OPT_APPEND_NEWLINE))
+                        
+                        st.success(f"✅ Saved to {output_file} (vectors in {vectors_file})")
+                    except Exception as e:
+                        st.error(f"❌ Failed to save JSON: {str(e)}")
+
 def main():
     """Main entry point for the application"""
     app = StreamlitApp()
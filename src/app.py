@@ -1,4 +1,5 @@
 import os
+import shutil
 import tempfile
 from pathlib import Path
 from loguru import logger
@@ -8,38 +9,55 @@ from src.utils import create_streaming_chat_completion, validate_sambanova_setup
 from src.vector_store import VectorStore
 from src.config import config
 from datetime import datetime
-import json
-import numpy as np
+import hashlib
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
 from qdrant_client.http.models import Distance, VectorParams, HnswConfigDiff
-import re
 import asyncio
 import requests
+import httpx
 import time
+import random
 import logging
 from typing import Optional, Dict, Any, List
 
-from src.services.qdrant_service import QdrantService
+from src.services.qdrant_service import QdrantService, LOCAL_SEARCH_MAX_POINTS
 from src.services.document_service import DocumentService
 from src.services.api_service import APIService
+from src.services.semantic_cache_service import SemanticCacheService
 from src.logging_config import setup_logging
 
 # Set up logging
 setup_logging()
 
-class NumpyEncoder(json.JSONEncoder):
-    """Custom JSON encoder for numpy types"""
-    def default(self, obj):
-        if isinstance(obj, np.ndarray):
-            return obj.tolist()
-        if isinstance(obj, np.integer):
-            return int(obj)
-        if isinstance(obj, np.floating):
-            return float(obj)
-        return super().default(obj)
+@st.cache_resource(show_spinner=False)
+def _qdrant_service() -> QdrantService:
+    """Shared Qdrant service; its connection survives script reruns"""
+    # Collections are sized to whatever the document service's model emits
+    return QdrantService(vector_size=_document_service().model.config.hidden_size)
 
-def connect_to_qdrant(max_retries=5, retry_delay=5):
+@st.cache_resource(show_spinner="Loading embedding model...")
+def _document_service() -> DocumentService:
+    """Shared document service; loads the embedding model once per process"""
+    return DocumentService(use_onnx=os.getenv("EMBED_ONNX", "false").lower() == "true")
+
+@st.cache_resource(show_spinner=False)
+def _api_service() -> APIService:
+    """Shared API key service; keeps derived keys in memory across reruns"""
+    return APIService()
+
+@st.cache_resource(show_spinner=False)
+def _semantic_cache_service() -> SemanticCacheService:
+    """Shared semantic cache service; embeds with the document service's model rather than a second copy"""
+    document_service = _document_service()
+    return SemanticCacheService(
+        tokenizer=document_service.tokenizer,
+        model=document_service.model,
+        device=document_service.device
+    )
+
+@st.cache_resource(show_spinner=False)
+def connect_to_qdrant(max_retries=5, retry_delay=0.5):
     """Connect to Qdrant with retries"""
     qdrant_url = config.get_qdrant_url()
     
@@ -49,9 +67,14 @@ def connect_to_qdrant(max_retries=5, retry_delay=5):
             client = QdrantClient(
                 url=qdrant_url,
                 port=config.qdrant_http_port,
+                grpc_port=config.qdrant_grpc_port,
                 timeout=30.0,
-                prefer_grpc=False,  # Use HTTP in App Runner
-                verify=config.qdrant_verify_ssl  # Use SSL verification based on config
+                # gRPC multiplexes requests over one HTTP/2 connection; App Runner's
+                # HTTPS-only ingress still needs plain HTTP
+                prefer_grpc=not config.qdrant_https,
+                verify=config.qdrant_verify_ssl,  # Use SSL verification based on config
+                # Passed through to the REST client's httpx pool
+                limits=httpx.Limits(max_keepalive_connections=20, max_connections=50)
             )
             # Test the connection
             client.get_collections()
@@ -59,8 +82,10 @@ def connect_to_qdrant(max_retries=5, retry_delay=5):
             return client
         except Exception as e:
             if attempt < max_retries - 1:
-                logger.warning(f"Failed to connect to Qdrant: {str(e)}. Retrying in {retry_delay} seconds...")
-                time.sleep(retry_delay)
+                # Exponential backoff with jitter so restarting workers don't retry in lockstep
+                delay = min(retry_delay * (2 ** attempt), 30) + random.uniform(0, retry_delay)
+                logger.warning(f"Failed to connect to Qdrant: {str(e)}. Retrying in {delay:.1f} seconds...")
+                time.sleep(delay)
             else:
                 logger.error(f"Failed to connect to Qdrant after {max_retries} attempts: {str(e)}")
                 raise
@@ -106,15 +131,16 @@ class StreamlitApp:
             )
         
         # Initialize services
-        self.qdrant_service = QdrantService()
-        self.document_service = DocumentService()
-        self.api_service = APIService()
+        self.qdrant_service = _qdrant_service()
+        self.document_service = _document_service()
+        self.api_service = _api_service()
+        self.semantic_cache = _semantic_cache_service()
         
         # Initialize session state
         self._init_session_state()
         
-        # Initialize Qdrant connection (lazy loading)
-        self.qdrant_connected = False
+        # Initialize Qdrant connection (lazy loading, then reused across reruns)
+        self.qdrant_connected = self.qdrant_service.is_connected
         
         # Create temporary directory
         self.temp_dir = tempfile.mkdtemp()
@@ -138,6 +164,10 @@ class StreamlitApp:
             st.session_state.query_running = False
         if 'current_response' not in st.session_state:
             st.session_state.current_response = None
+        if 'sem_cache' not in st.session_state:
+            st.session_state.sem_cache = []
+        if 'chat_fingerprints' not in st.session_state:
+            st.session_state.chat_fingerprints = set()
             
     def _ensure_qdrant_connection(self) -> bool:
         """Ensure Qdrant is connected before performing operations.
@@ -174,6 +204,7 @@ class StreamlitApp:
                     # Show API key management
                     st.success("✅ API Key Configured")
                     if st.button("Change API Key"):
+                        self.api_service.clear_cache()
                         st.session_state.api_authenticated = False
                         st.experimental_rerun()
             else:
@@ -229,7 +260,8 @@ class StreamlitApp:
         try:
             # Save uploaded file temporarily
             with tempfile.NamedTemporaryFile(delete=False, suffix='.txt') as tmp_file:
-                tmp_file.write(uploaded_file.getvalue())
+                uploaded_file.seek(0)
+                shutil.copyfileobj(uploaded_file, tmp_file, length=1 << 20)
                 tmp_path = tmp_file.name
             
             # Process document
@@ -244,7 +276,8 @@ class StreamlitApp:
                     st.session_state.documents.append({
                         'name': uploaded_file.name,
                         'path': saved_path,
-                        'processed': processed_doc
+                        'processed': processed_doc,
+                        'search_matrix': self.qdrant_service.build_local_index(processed_doc['embeddings'])
                     })
                     st.success(f"Successfully processed {uploaded_file.name}")
                 else:
@@ -321,16 +354,26 @@ class StreamlitApp:
             with st.chat_message("user"):
                 st.text_area("", prompt, height=200, disabled=True)
             
-            # Process query
-            if self._ensure_qdrant_connection():
+            # Process query; small documents are searched in memory, larger ones in Qdrant
+            search_matrix = doc.get('search_matrix')
+            use_local = search_matrix is not None and len(search_matrix) <= LOCAL_SEARCH_MAX_POINTS
+            if use_local or self._ensure_qdrant_connection():
                 # Generate query embedding
                 query_embedding = self.document_service._generate_embeddings([prompt])[0]
                 
                 # Search for similar chunks
-                results = self.qdrant_service.search_similar(
-                    collection_name=doc['name'],
-                    query_vector=query_embedding
-                )
+                if use_local:
+                    results = self.qdrant_service.search_local(
+                        query_vector=query_embedding,
+                        embeddings=search_matrix,
+                        chunks=doc['processed']['chunks'],
+                        document_name=doc['name']
+                    )
+                else:
+                    results = self.qdrant_service.search_similar(
+                        collection_name=doc['name'],
+                        query_vector=query_embedding
+                    )
                 
                 if results:
                     # Prepare response
@@ -365,19 +408,37 @@ class StreamlitApp:
         
         return response
     
-    async def process_query(self, query: str, is_doc_query: bool = False, split_content: str = None):
+    def save_chat_history(self, query: str, response: str, timestamp: str, is_doc_query: bool = False):
+        """Append a query/response exchange to the chat history, skipping exact repeats.
+        
+        Args:
+            query: User query
+            response: Assistant response
+            timestamp: ISO timestamp of the exchange
+            is_doc_query: Whether the query was about a document
+        """
+        # Fingerprint set gives O(1) duplicate checks instead of scanning the whole history
+        fingerprint = hashlib.blake2b(f"{query}\0{response}".encode(), digest_size=16).digest()
+        if fingerprint in st.session_state.chat_fingerprints:
+            return
+        st.session_state.chat_fingerprints.add(fingerprint)
+        st.session_state.chat_history.extend([
+            {"role": "user", "content": query, "timestamp": timestamp, "is_doc_query": is_doc_query},
+            {"role": "assistant", "content": response, "timestamp": timestamp, "is_doc_query": is_doc_query}
+        ])
+    
+    async def process_query(self, query: str, is_doc_query: bool = False, split_content: str = None,
+                            split_tokens: Optional[int] = None):
         """Process a query with streaming response and save history"""
         try:
-            # Initialize tokenizer
-            from transformers import BertTokenizer
-            tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
-            
             # Prepare messages based on query type
             if is_doc_query:
                 if split_content:  # For split analysis queries
-                    # Count tokens but don't enforce BERT's limit
-                    token_count = len(tokenizer.encode(split_content, add_special_tokens=False))
-                    logger.info(f"Split content token count: {token_count}")
+                    # Reuse the count computed when the split was created; never re-tokenize here
+                    if split_tokens is not None:
+                        logger.debug(f"Split content token count: {split_tokens}")
+                    else:
+                        logger.opt(lazy=True).debug("Split content token estimate: {}", lambda: len(split_content) // 4)
                     
                     messages = [
                         {"role": "system", "content": "You are a helpful assistant analyzing a specific section of a document."},
@@ -385,9 +446,11 @@ class StreamlitApp:
                     ]
                     max_tokens = 4096
                 else:  # For full document queries
-                    # Count tokens but don't enforce BERT's limit
-                    token_count = len(tokenizer.encode(st.session_state.doc_content, add_special_tokens=False))
-                    logger.info(f"Full document token count: {token_count}")
+                    # Reuse the count computed at upload time; never re-tokenize here
+                    if st.session_state.get('total_tokens') is not None:
+                        logger.debug(f"Full document token count: {st.session_state.total_tokens}")
+                    else:
+                        logger.opt(lazy=True).debug("Full document token estimate: {}", lambda: len(st.session_state.doc_content) // 4)
                     
                     messages = [
                         {"role": "system", "content": "You are a helpful assistant analyzing documents."},
@@ -412,19 +475,37 @@ class StreamlitApp:
             # Log the content being sent
             if split_content:
                 logger.info(f"Processing split content of length: {len(split_content)} chars")
-                logger.info(f"Token count for split: {len(tokenizer.encode(split_content))}")
 
-            # Stream the response
+            # Answer paraphrases of recent queries on the same content from the semantic cache
+            if is_doc_query:
+                cache_scope = f"doc:{hash(split_content or st.session_state.doc_content)}"
+            else:
+                cache_scope = "chat"
+            query_embedding = self.semantic_cache.embed(query)
+            cached_response = self.semantic_cache.lookup(st.session_state.sem_cache, query_embedding, cache_scope)
+            if cached_response:
+                response_container.markdown(cached_response)
+                st.session_state.current_response = cached_response
+                self.save_chat_history(query, cached_response, datetime.now().isoformat(), is_doc_query)
+                return cached_response
+
+            # Stream the response, repainting at most ~20 times a second
+            # (or every 8 chunks) instead of once per chunk
+            chunks = []
+            last_flush = time.monotonic()
             async for content in create_streaming_chat_completion(messages, max_tokens=max_tokens):
                 if content:
-                    full_response += content
-                    response_container.markdown(full_response + "▌")
-                    st.session_state.current_response = full_response
+                    chunks.append(content)
+                    if len(chunks) % 8 == 0 or time.monotonic() - last_flush > 0.05:
+                        response_container.markdown("".join(chunks) + "▌")
+                        last_flush = time.monotonic()
+            full_response = "".join(chunks)
 
             # Final update without cursor
             if full_response:
                 response_container.markdown(full_response)
                 st.session_state.current_response = full_response
+                self.semantic_cache.store(st.session_state.sem_cache, query_embedding, full_response, cache_scope)
                 
                 # Save chat history
                 self.save_chat_history(query, full_response, datetime.now().isoformat(), is_doc_query)
@@ -1,35 +1,55 @@
 import os
+import io
 import tempfile
-from pathlib import Path
 from loguru import logger
 import streamlit as st
 from datetime import datetime
-import json
+import hashlib
 import numpy as np
+import orjson
 import asyncio
-from qdrant_client import QdrantClient
-from qdrant_client.http import models
-from qdrant_client.http.models import Distance, VectorParams, HnswConfigDiff
-import re
-import plotly.express as px
+import random
+import time
+from qdrant_client import QdrantClient, AsyncQdrantClient
+import ssl
+import httpx
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 
 from src.document_processor import DocumentProcessor
-from src.utils import create_streaming_chat_completion, validate_sambanova_setup
+from src.utils import (
+    create_streaming_chat_completion,
+    validate_sambanova_setup,
+    run_async,
+    iterate_async,
+    get_bert_tokenizer,
+    get_token_offsets,
+    create_document_splits,
+    trim_history
+)
 from src.vector_store import VectorStore
+from src.services.semantic_cache_service import SemanticCacheService
 
-class NumpyEncoder(json.JSONEncoder):
-    """Custom JSON encoder for numpy types"""
-    def default(self, obj):
-        if isinstance(obj, np.ndarray):
-            return obj.tolist()
-        if isinstance(obj, np.integer):
-            return int(obj)
-        if isinstance(obj, np.floating):
-            return float(obj)
-        return super().default(obj)
-
-def connect_to_qdrant(max_retries=5, retry_delay=5):
-    """Connect to Qdrant with retries"""
+@lru_cache(maxsize=1)
+def _qdrant_ssl_context() -> ssl.SSLContext:
+    """Build the TLS context shared by every Qdrant connection.
+
+    With QDRANT_CA_BUNDLE set, certificates are verified against that bundle.
+    Otherwise checks stay off for internal VPC traffic. Either way, reusing one
+    context lets the HTTP pool resume TLS sessions instead of doing a full
+    handshake for each new connection.
+    """
+    ca_bundle = os.getenv("QDRANT_CA_BUNDLE")
+    if ca_bundle:
+        return ssl.create_default_context(cafile=ca_bundle)
+    
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+def _qdrant_client_kwargs(prefer_grpc: bool = True) -> dict:
+    """Build Qdrant client arguments from the environment configuration"""
     qdrant_host = os.getenv("QDRANT_HOST")
     if not qdrant_host:
         raise ValueError("QDRANT_HOST environment variable must be set")
@@ -38,29 +58,272 @@ def connect_to_qdrant(max_retries=5, retry_delay=5):
     qdrant_https = os.getenv("QDRANT_HTTPS", "false").lower() == "true"
     qdrant_url = f"https://{qdrant_host}" if qdrant_https else f"http://{qdrant_host}"
     qdrant_port = int(os.getenv("QDRANT_PORT", "6333"))
+    qdrant_grpc_port = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+    pool_size = int(os.getenv("QDRANT_POOL", "100"))
     
-    for attempt in range(max_retries):
+    logger.info(f"Connecting to Qdrant at: {qdrant_url}:{qdrant_grpc_port if prefer_grpc else qdrant_port} "
+                f"({'gRPC' if prefer_grpc else 'HTTP'})")
+    return dict(
+        url=qdrant_url,
+        port=qdrant_port,
+        grpc_port=qdrant_grpc_port,
+        timeout=30.0,
+        prefer_grpc=prefer_grpc,  # Protobuf over gRPC; HTTP only as a fallback
+        # Plain HTTP needs no TLS setup; HTTPS reuses one shared context
+        verify=_qdrant_ssl_context() if qdrant_https else False,
+        # Passed through to the REST client's httpx pool; sized for concurrent
+        # upserts and kept warm between requests
+        limits=httpx.Limits(
+            max_connections=pool_size,
+            max_keepalive_connections=pool_size,
+            keepalive_expiry=300
+        )
+    )
+
+def _create_qdrant_client(prefer_grpc: bool = True) -> QdrantClient:
+    """Create a Qdrant client from the environment configuration"""
+    return QdrantClient(**_qdrant_client_kwargs(prefer_grpc))
+
+# Set once gRPC has failed while HTTP to the same server worked, so later
+# connections go straight to HTTP; cleared when the user asks to reconnect
+_GRPC_UNAVAILABLE = False
+
+def _grpc_enabled() -> bool:
+    """gRPC is the default transport; QDRANT_GRPC=false forces plain HTTP"""
+    return os.getenv("QDRANT_GRPC", "true").lower() == "true" and not _GRPC_UNAVAILABLE
+
+def _grpc_failed(e: Exception) -> None:
+    """Remember that the gRPC transport itself is unusable so later connections skip the probe"""
+    global _GRPC_UNAVAILABLE
+    _GRPC_UNAVAILABLE = True
+    logger.warning(f"Qdrant is reachable over HTTP but not gRPC ({str(e)}); using HTTP from now on")
+
+def _reset_grpc_probe() -> None:
+    """Let the next connection try gRPC again"""
+    global _GRPC_UNAVAILABLE
+    _GRPC_UNAVAILABLE = False
+
+def _open_qdrant_client() -> QdrantClient:
+    """Open a tested Qdrant connection, preferring gRPC and falling back to HTTP"""
+    grpc_error = None
+    if _grpc_enabled():
+        client = None
         try:
-            logger.info(f"Connecting to Qdrant at: {qdrant_url}:{qdrant_port} (Attempt {attempt + 1}/{max_retries})")
-            client = QdrantClient(
-                url=qdrant_url,
-                port=qdrant_port,
-                timeout=30.0,
-                prefer_grpc=False,  # Use HTTP in App Runner
-                verify=False  # Skip SSL verification for internal VPC communication
-            )
-            # Test the connection
+            client = _create_qdrant_client(prefer_grpc=True)
             client.get_collections()
+            return client
+        except Exception as e:
+            # Release the failed client's channel rather than leaking it
+            if client is not None:
+                client.close()
+            logger.warning(f"gRPC connection to Qdrant failed: {str(e)}. Trying HTTP")
+            grpc_error = e
+    
+    # If Qdrant itself is down this raises too, and gRPC stays enabled for the retry
+    client = _create_qdrant_client(prefer_grpc=False)
+    try:
+        client.get_collections()
+    except Exception:
+        client.close()
+        raise
+    if grpc_error is not None:
+        _grpc_failed(grpc_error)
+    return client
+
+async def _aopen_qdrant_client() -> AsyncQdrantClient:
+    """Async counterpart of _open_qdrant_client"""
+    grpc_error = None
+    if _grpc_enabled():
+        client = None
+        try:
+            client = AsyncQdrantClient(**_qdrant_client_kwargs(prefer_grpc=True))
+            await client.get_collections()
+            return client
+        except Exception as e:
+            if client is not None:
+                await client.close()
+            logger.warning(f"gRPC connection to Qdrant failed: {str(e)}. Trying HTTP")
+            grpc_error = e
+    
+    client = AsyncQdrantClient(**_qdrant_client_kwargs(prefer_grpc=False))
+    try:
+        await client.get_collections()
+    except Exception:
+        await client.close()
+        raise
+    if grpc_error is not None:
+        _grpc_failed(grpc_error)
+    return client
+
+def _backoff_delay(attempt, retry_delay, max_delay=60):
+    """Exponential backoff with jitter so restarting workers don't retry in lockstep"""
+    return min(retry_delay * (2 ** attempt), max_delay) + random.uniform(0, retry_delay)
+
+def connect_to_qdrant(max_retries=5, retry_delay=0.5):
+    """Connect to Qdrant with retries"""
+    for attempt in range(max_retries):
+        try:
+            logger.info(f"Qdrant connection attempt {attempt + 1}/{max_retries}")
+            client = _open_qdrant_client()
             logger.info("Successfully connected to Qdrant")
             return client
         except Exception as e:
             if attempt < max_retries - 1:
-                logger.warning(f"Failed to connect to Qdrant: {str(e)}. Retrying in {retry_delay} seconds...")
-                time.sleep(retry_delay)
+                delay = _backoff_delay(attempt, retry_delay)
+                logger.warning(f"Failed to connect to Qdrant: {str(e)}. Retrying in {delay:.1f} seconds...")
+                time.sleep(delay)
             else:
                 logger.error(f"Failed to connect to Qdrant after {max_retries} attempts: {str(e)}")
                 raise
 
+async def aconnect_to_qdrant(max_retries=5, retry_delay=0.5) -> AsyncQdrantClient:
+    """Connect an AsyncQdrantClient with retries without blocking the event loop"""
+    for attempt in range(max_retries):
+        try:
+            logger.info(f"Qdrant connection attempt {attempt + 1}/{max_retries}")
+            client = await _aopen_qdrant_client()
+            logger.info("Successfully connected to Qdrant")
+            return client
+        except Exception as e:
+            if attempt < max_retries - 1:
+                delay = _backoff_delay(attempt, retry_delay)
+                logger.warning(f"Failed to connect to Qdrant: {str(e)}. Retrying in {delay:.1f} seconds...")
+                await asyncio.sleep(delay)
+            else:
+                logger.error(f"Failed to connect to Qdrant after {max_retries} attempts: {str(e)}")
+                raise
+
+@st.cache_resource(show_spinner=False)
+def get_qdrant_client() -> QdrantClient:
+    """Process-wide Qdrant client; failed connections are not cached and retry on the next run"""
+    return connect_to_qdrant()
+
+@st.cache_resource(show_spinner=False)
+def get_document_processor() -> DocumentProcessor:
+    """Process-wide document processor"""
+    return DocumentProcessor()
+
+@st.cache_resource(show_spinner=False)
+def get_semantic_cache_service() -> SemanticCacheService:
+    """Process-wide sentence embedder for semantic cache keys"""
+    return SemanticCacheService()
+
+def _cache_context_key(messages: list, **sampling) -> str:
+    """Hash everything that shapes a response besides the query: prompt, history and sampling parameters"""
+    return hashlib.blake2b(
+        orjson.dumps([messages, sampling], option=orjson.OPT_SORT_KEYS), digest_size=16
+    ).hexdigest()
+
+def get_vector_store(client: QdrantClient) -> VectorStore:
+    """This session's vector store over an already connected client; BERT is loaded once per process and shared"""
+    store = st.session_state.get('vector_store')
+    # A reconnect hands over a new client, so the store is rebuilt around it
+    if store is None or store.client is not client:
+        with st.spinner("Loading embedding model..."):
+            store = st.session_state.vector_store = VectorStore(client=client)
+    return store
+
+@st.cache_data(show_spinner=False)
+def _extract_text(file_hash: str, _file_bytes: bytes) -> str:
+    """Extract text from an uploaded PDF, once per distinct file content"""
+    # Read straight from memory instead of round-tripping through a temp file
+    return get_document_processor().extract_pdf_text(io.BytesIO(_file_bytes))
+
+@st.cache_data(show_spinner=False)
+def _extract_and_tokenize(file_hash: str, file_name: str, _file_bytes: bytes):
+    """Extract an uploaded document's text and tokenize it, once per distinct file content"""
+    _, ext = os.path.splitext(file_name)
+    if ext.lower() == ".pdf":
+        content = _extract_text(file_hash, _file_bytes)
+    else:
+        # Other formats are parsed from disk, so spool them to a temp file of the same type
+        with tempfile.NamedTemporaryFile(suffix=ext) as f:
+            f.write(_file_bytes)
+            f.flush()
+            content = get_document_processor().extract_text(f.name)
+    
+    # Keep each token's start offset so splits are cut by slicing, not by re-tokenizing
+    token_starts = get_token_offsets(content, get_bert_tokenizer())[:, 0].astype(np.int32)
+    return content, token_starts
+
+@st.cache_data(show_spinner=False)
+def _chunk_document(file_hash: str, _text: str, _vector_store: VectorStore) -> list:
+    """Chunk document text, once per distinct file content"""
+    return _vector_store.chunk_text(_text)
+
+# Embedding runs here so the event loop keeps uploading earlier batches meanwhile
+_EMBED_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="embed")
+
+@st.cache_data(show_spinner=False)
+def _split_document(doc_hash: str, _content: str, _token_starts, max_chunk_size: int) -> list:
+    """Split document text into token-bounded splits, once per document and split size"""
+    return create_document_splits(_content, _token_starts, max_chunk_size)
+
+@st.cache_data(show_spinner=False)
+def _build_graph_json(doc_hash: str, _doc_content: str) -> str:
+    """Embed a document and build its visualization, once per distinct content, as figure JSON"""
+    # A store of its own: codebooks and PQ codes are rebuilt in place, so sharing
+    # one across sessions would expose half-trained state to concurrent readers
+    vector_store = VectorStore(client=get_qdrant_client())
+    # Visualization only needs the PQ state; chat retrieval has its own ingest path
+    vector_store.process_document(_doc_content, store=False)
+    return vector_store.create_interactive_graph().to_json()
+
+@st.cache_data(show_spinner=False)
+def _retrieve_chunks(document_hash: str, query: str, _vector_store: VectorStore, limit: int = 5) -> list:
+    """Top-k chunks of the ingested document for a query, once per document and query"""
+    return _vector_store.search_chunks(query, document_hash, limit=limit)
+
+@st.cache_data(persist="disk", show_spinner=False)
+def _load_saved_responses(file_path: str) -> list:
+    """Parse the JSONL response log; cleared whenever a response is appended"""
+    if not os.path.exists(file_path):
+        return []
+    try:
+        with open(file_path, 'rb') as f:
+            return [orjson.loads(line) for line in f if line.strip()]
+    except Exception as e:
+        logger.error(f"Failed to load saved responses: {str(e)}")
+        return []
+
+# Models offered in the selectors, with each one's position for the default index
+MODEL_OPTIONS = (
+    "DeepSeek-R1-Distill-Llama-70B",
+    "DeepSeek-R1",
+    "Llama-3.1-Tulu-3-405B",
+    "Meta-Llama-3.3-70B-Instruct",
+    "Meta-Llama-3.1-405B-Instruct",
+    "Meta-Llama-2-70B-Chat",
+    "Meta-Llama-2-13B-Chat",
+    "Meta-Llama-2-7B-Chat"
+)
+MODEL_INDEX = {model: i for i, model in enumerate(MODEL_OPTIONS)}
+
+_SESSION_DEFAULTS = {
+    'messages': [],
+    'current_document': None,
+    'document_chunks': [],
+    'is_authenticated': False,
+    'api_key': None,
+    'password': None,
+    'selected_model': MODEL_OPTIONS[0],
+    'temperature': 0.7,
+    'max_tokens': 1000,
+    'top_p': 0.9,
+    'doc_content': None,
+    'doc_hash': None,
+    'doc_name': None,
+    'api_validated': False,
+    'chat_history': [],
+    'chat_responses': [],
+    'total_tokens': 0,
+    'token_starts': None,
+    'embedding_fig': None,
+    'no_cache': False,
+}
+
+_HEADERS_ADDED = False
+
 class StreamlitApp:
     def __init__(self):
         """Initialize the Streamlit app"""
@@ -70,8 +333,10 @@ class StreamlitApp:
             initial_sidebar_state="expanded"
         )
         
-        # Configure server headers for WebSocket support
-        if hasattr(st, '_server'):
+        # Configure server headers for WebSocket support; the server outlives
+        # script reruns, so the headers only need adding once per process
+        global _HEADERS_ADDED
+        if not _HEADERS_ADDED and hasattr(st, '_server'):
             st._server.add_header(
                 "Content-Security-Policy",
                 "default-src 'self' 'unsafe-inline' 'unsafe-eval' https: data: ws: wss:; "
@@ -97,62 +362,28 @@ class StreamlitApp:
                 "X-Frame-Options",
                 "SAMEORIGIN"
             )
+            _HEADERS_ADDED = True
 
         # Connect to Qdrant with retries
         try:
-            self.qdrant_client = connect_to_qdrant()
+            self.qdrant_client = get_qdrant_client()
         except Exception as e:
             logger.error(f"Failed to connect to Qdrant: {str(e)}")
             self.qdrant_client = None
 
-        self.temp_dir = tempfile.mkdtemp()
-        logger.info(f"Created temporary directory: {self.temp_dir}")
-        
-        # Initialize document processor and vector store
-        self.document_processor = DocumentProcessor()
-        self.vector_store = VectorStore()
+        # Reuse the process-wide document processor and this session's vector store across reruns;
+        # without a client there is no store, and the features that need one are skipped
+        self.document_processor = get_document_processor()
+        self.vector_store = get_vector_store(self.qdrant_client) if self.qdrant_client is not None else None
         
         # Initialize session state
         self.setup_session_state()
         
     def setup_session_state(self):
         """Initialize session state variables"""
-        if 'messages' not in st.session_state:
-            st.session_state.messages = []
-        if 'current_document' not in st.session_state:
-            st.session_state.current_document = None
-        if 'document_chunks' not in st.session_state:
-            st.session_state.document_chunks = []
-        if 'is_authenticated' not in st.session_state:
-            st.session_state.is_authenticated = False
-        if 'api_key' not in st.session_state:
-            st.session_state.api_key = None
-        if 'password' not in st.session_state:
-            st.session_state.password = None
-        if 'selected_model' not in st.session_state:
-            st.session_state.selected_model = "DeepSeek-R1-Distill-Llama-70B"
-        if 'temperature' not in st.session_state:
-            st.session_state.temperature = 0.7
-        if 'max_tokens' not in st.session_state:
-            st.session_state.max_tokens = 1000
-        if 'top_p' not in st.session_state:
-            st.session_state.top_p = 0.9
-        if 'doc_content' not in st.session_state:
-            st.session_state.doc_content = None
-        if 'doc_name' not in st.session_state:
-            st.session_state.doc_name = None
-        if 'api_validated' not in st.session_state:
-            st.session_state.api_validated = False
-        if 'chat_history' not in st.session_state:
-            st.session_state.chat_history = []
-        if 'chat_responses' not in st.session_state:
-            st.session_state.chat_responses = []
-        if 'saved_responses' not in st.session_state:
-            st.session_state.saved_responses = []
-        if 'total_tokens' not in st.session_state:
-            st.session_state.total_tokens = 0
-        if 'embedding_fig' not in st.session_state:
-            st.session_state.embedding_fig = None
+        for key, default in _SESSION_DEFAULTS.items():
+            # Copy mutable defaults so sessions never share one list
+            st.session_state.setdefault(key, default.copy() if isinstance(default, list) else default)
         
     def render_login(self):
         """Render the login interface"""
@@ -196,52 +427,21 @@ class StreamlitApp:
         with st.sidebar:
             st.title("Settings")
             
-            # SambaNova Model Settings
-            st.subheader("Model Settings")
-            
-            # Define available models
-            model_options = [
-                "DeepSeek-R1-Distill-Llama-70B",
-                "DeepSeek-R1",
-                "Llama-3.1-Tulu-3-405B",
-                "Meta-Llama-3.3-70B-Instruct",
-                "Meta-Llama-3.1-405B-Instruct",
-                "Meta-Llama-2-70B-Chat",
-                "Meta-Llama-2-13B-Chat",
-                "Meta-Llama-2-7B-Chat"
-            ]
+            # Model settings run as a fragment so tweaking them doesn't rerun the page
+            self._render_model_settings()
             
-            # Model selection
-            st.session_state.selected_model = st.selectbox(
-                "Select Model",
-                options=model_options,
-                index=model_options.index(st.session_state.selected_model),
-                key="model_selector"
-            )
-            
-            st.session_state.temperature = st.slider(
-                "Temperature",
-                min_value=0.0,
-                max_value=2.0,
-                value=st.session_state.temperature,
-                step=0.1
-            )
-            
-            st.session_state.max_tokens = st.slider(
-                "Max Tokens",
-                min_value=100,
-                max_value=4000,
-                value=st.session_state.max_tokens,
-                step=100
-            )
-            
-            st.session_state.top_p = st.slider(
-                "Top P",
-                min_value=0.0,
-                max_value=1.0,
-                value=st.session_state.top_p,
-                step=0.1
-            )
+            # The cached client is only re-probed on request, not on every rerun
+            if st.button("Reconnect to Qdrant"):
+                _reset_grpc_probe()
+                get_qdrant_client.clear()
+                try:
+                    self.qdrant_client = get_qdrant_client()
+                    self.vector_store = get_vector_store(self.qdrant_client)
+                    st.success("Connected to Qdrant")
+                except Exception as e:
+                    self.qdrant_client = None
+                    self.vector_store = None
+                    st.error(f"Failed to connect to Qdrant: {str(e)}")
             
             # Document Upload
             st.subheader("Document Upload")
@@ -252,31 +452,31 @@ class StreamlitApp:
             )
             
             if uploaded_file:
-                try:
-                    # Save uploaded file temporarily
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-                        tmp_file.write(uploaded_file.getvalue())
-                        tmp_file_path = tmp_file.name
-                    
-                    # Process document
-                    text = self.document_processor.extract_text(tmp_file_path)
-                    st.session_state.current_document = text
-                    
-                    # Process document into chunks
-                    chunks = self.vector_store.process_document(text)
-                    st.session_state.document_chunks = chunks
-                    
-                    st.success("Document processed successfully!")
-                    
-                except Exception as e:
-                    st.error(f"Error processing document: {str(e)}")
-                    logger.error(f"Error processing document: {str(e)}")
-                finally:
-                    # Clean up temporary file
+                # A view of the upload's buffer; only a cache miss copies it
+                file_bytes = uploaded_file.getbuffer()
+                file_hash = hashlib.blake2b(file_bytes, digest_size=16).hexdigest()
+                
+                # Reruns with the same file still selected skip the whole pipeline
+                if self.vector_store is None:
+                    st.error("Not connected to Qdrant; reconnect to process documents")
+                elif st.session_state.get('document_hash') != file_hash:
                     try:
-                        os.unlink(tmp_file_path)
+                        # Process document; identical content is served from cache
+                        text = _extract_text(file_hash, file_bytes)
+                        st.session_state.current_document = text
+                        
+                        # Embed and upload chunks batch by batch. The collection is shared by
+                        # every session, so its HNSW index stays on while this upload runs
+                        chunks = _chunk_document(file_hash, text, self.vector_store)
+                        run_async(self._ingest(chunks, file_hash))
+                        st.session_state.document_chunks = chunks
+                        st.session_state.document_hash = file_hash
+                        
+                        st.success("Document processed successfully!")
+                        
                     except Exception as e:
-                        logger.warning(f"Failed to delete temporary file: {str(e)}")
+                        st.error(f"Error processing document: {str(e)}")
+                        logger.error(f"Error processing document: {str(e)}")
             
             if st.button("Clear Chat History"):
                 st.session_state.messages = []
@@ -287,6 +487,100 @@ class StreamlitApp:
                 st.session_state.messages = []
                 st.rerun()
                 
+    @st.fragment
+    def _render_model_settings(self):
+        """Render the SambaNova model settings.
+
+        The values live in session state and are only read when a query is
+        sent, so changing them reruns just this fragment instead of the chat,
+        document and split-analysis views.
+        """
+        st.subheader("Model Settings")
+        
+        # Model selection
+        st.session_state.selected_model = st.selectbox(
+            "Select Model",
+            options=MODEL_OPTIONS,
+            index=MODEL_INDEX.get(st.session_state.selected_model, 0),
+            key="model_selector"
+        )
+        
+        st.session_state.temperature = st.slider(
+            "Temperature",
+            min_value=0.0,
+            max_value=2.0,
+            value=st.session_state.temperature,
+            step=0.1
+        )
+        
+        st.session_state.max_tokens = st.slider(
+            "Max Tokens",
+            min_value=100,
+            max_value=4000,
+            value=st.session_state.max_tokens,
+            step=100
+        )
+        
+        st.session_state.top_p = st.slider(
+            "Top P",
+            min_value=0.0,
+            max_value=1.0,
+            value=st.session_state.top_p,
+            step=0.1
+        )
+        
+        st.session_state.no_cache = st.checkbox(
+            "Do not use cached responses",
+            value=st.session_state.no_cache,
+            help="Always query the model instead of reusing answers to similar questions"
+        )
+
+    async def _ingest(self, chunks, document_hash, batch_size=256, concurrency=8):
+        """Embed and upsert document chunks, overlapping each batch's embedding with earlier uploads.
+
+        Points are tagged with document_hash so retrieval never mixes in chunks
+        from another upload or session.
+        """
+        from qdrant_client.http import models
+        
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(concurrency)
+        client = await aconnect_to_qdrant()
+        
+        async def upsert_batch(start, vectors):
+            async with semaphore:
+                # Don't wait for each batch to be indexed; Qdrant indexes in the background.
+                # A column-oriented Batch is validated once, not once per point
+                await client.upsert(
+                    collection_name=self.vector_store.collection_name,
+                    points=models.Batch(
+                        ids=self.vector_store.point_ids(document_hash, len(vectors), start),
+                        vectors=vectors.tolist(),
+                        payloads=[
+                            {"text": chunk, "document_hash": document_hash}
+                            for chunk in chunks[start:start + len(vectors)]
+                        ]
+                    ),
+                    wait=False
+                )
+        
+        uploads = []
+        try:
+            for start in range(0, len(chunks), batch_size):
+                # Embedding blocks in the pool while the batches already queued upload
+                vectors = await loop.run_in_executor(
+                    _EMBED_POOL, self.vector_store.embed_batch, chunks[start:start + batch_size]
+                )
+                uploads.append(asyncio.ensure_future(upsert_batch(start, vectors)))
+            await asyncio.gather(*uploads)
+            logger.info(f"Stored {len(chunks)} points in Qdrant")
+        except BaseException:
+            for upload in uploads:
+                upload.cancel()
+            raise
+        finally:
+            await client.close()
+
     def render_chat_interface(self):
         """Render the chat interface"""
         st.write("### Chat Interface")
@@ -306,15 +600,148 @@ class StreamlitApp:
                 if not st.session_state.chat_query_running:
                     try:
                         st.session_state.chat_query_running = True
-                        # Run async query in a new event loop
-                        response = asyncio.run(self.process_query(query, is_doc_query=False))
+                        response = self.process_query(query, is_doc_query=False)
                         if response:
-                            st.session_state.current_response = response
+                            entry = {
+                                "query": query,
+                                "response": response,
+                                "timestamp": datetime.now().isoformat()
+                            }
+                            self.save_response_to_file(entry)
+                            st.session_state.saved_responses.append(entry)
                     finally:
                         st.session_state.chat_query_running = False
             else:
                 st.warning("Please enter a query")
 
+    def save_response_to_file(self, response: dict, file_path: str = "data/responses.jsonl"):
+        """Append a single response to the JSONL response log"""
+        try:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'ab', buffering=1 << 16) as f:
+                f.write(orjson.dumps(response, option=orjson.OPT_APPEND_NEWLINE))
+            _load_saved_responses.clear()
+        except Exception as e:
+            logger.error(f"Failed to save response: {str(e)}")
+
+    def load_saved_responses(self, file_path: str = "data/responses.jsonl") -> list:
+        """Load all responses from the JSONL response log"""
+        return _load_saved_responses(file_path)
+
+    def process_query(self, query: str, is_doc_query: bool = False):
+        """Process a query with streaming response.
+
+        Runs on the script thread so it can update the page; only the HTTP
+        stream itself is driven on the shared background loop.
+        """
+        try:
+            # Prepare messages based on query type
+            if is_doc_query and st.session_state.doc_content:
+                messages = [
+                    {"role": "system", "content": "You are a helpful assistant analyzing documents."},
+                    {"role": "user", "content": f"Document content: {st.session_state.doc_content}\n\nQuestion: {query}"}
+                ]
+            else:
+                # Ground the answer in the uploaded document's most relevant chunks
+                # rather than sending the whole document
+                system_prompt = "You are a helpful assistant"
+                document_hash = st.session_state.get('document_hash')
+                if document_hash and not is_doc_query and self.vector_store is not None:
+                    try:
+                        chunks = _retrieve_chunks(document_hash, query, self.vector_store)
+                        if chunks:
+                            system_prompt += (
+                                ". Use these excerpts from the uploaded document where relevant:\n\n"
+                                + "\n\n---\n\n".join(chunks)
+                            )
+                    except Exception as e:
+                        logger.warning(f"Document retrieval failed: {str(e)}")
+                
+                # Send only as much recent history as fits the context budget
+                messages = trim_history([
+                    {"role": "system", "content": system_prompt},
+                    *st.session_state.messages,
+                    {"role": "user", "content": query}
+                ])
+            
+            # Create placeholder for streaming output
+            response_container = st.empty()
+            full_response = ""
+            
+            # Answer near-duplicate opening questions from the semantic cache.
+            # Follow-ups depend on the conversation and grounded answers on the
+            # document, so neither is cached; the rest of the prompt and the
+            # sampling parameters are part of the key
+            use_cache = (
+                not is_doc_query
+                and not st.session_state.no_cache
+                and not st.session_state.get('document_hash')
+                and not st.session_state.messages
+                and self.vector_store is not None
+            )
+            cached_response = None
+            if use_cache:
+                try:
+                    query_embedding = get_semantic_cache_service().embed(query)
+                    context_key = _cache_context_key(
+                        messages[:-1],
+                        temperature=st.session_state.temperature,
+                        top_p=st.session_state.top_p,
+                        max_tokens=st.session_state.max_tokens
+                    )
+                    cached_response = self.vector_store.lookup_cached_response(
+                        query_embedding, st.session_state.selected_model, context_key
+                    )
+                except Exception as e:
+                    logger.warning(f"Semantic cache lookup failed: {str(e)}")
+                    use_cache = False
+            
+            if cached_response:
+                full_response = cached_response
+            else:
+                # Stream the response, repainting at most ~20 times a second
+                # (or every 32 chunks) instead of once per chunk
+                buffer = []
+                last_flush = time.monotonic()
+                for content in iterate_async(create_streaming_chat_completion(
+                    messages,
+                    max_tokens=st.session_state.max_tokens,
+                    temperature=st.session_state.temperature,
+                    top_p=st.session_state.top_p
+                )):
+                    buffer.append(content)
+                    if len(buffer) > 32 or time.monotonic() - last_flush > 0.05:
+                        full_response += "".join(buffer)
+                        buffer.clear()
+                        response_container.markdown(full_response + "▌")
+                        last_flush = time.monotonic()
+                full_response += "".join(buffer)
+            
+            if not full_response:
+                st.error("No response received from the API")
+                return None
+            
+            # Final update without cursor
+            response_container.markdown(full_response)
+            if use_cache and not cached_response:
+                try:
+                    self.vector_store.cache_response(
+                        query_embedding, full_response, st.session_state.selected_model, context_key
+                    )
+                except Exception as e:
+                    logger.warning(f"Failed to cache response: {str(e)}")
+            if not is_doc_query:
+                st.session_state.messages.extend([
+                    {"role": "user", "content": query},
+                    {"role": "assistant", "content": full_response}
+                ])
+            return full_response
+            
+        except Exception as e:
+            st.error(f"Error processing query: {str(e)}")
+            logger.error(f"Query processing error: {str(e)}")
+            return None
+
     def render_document_chat(self):
         """Render the document chat interface"""
         st.write("### Document Analysis")
@@ -344,11 +771,18 @@ class StreamlitApp:
             if uploaded_file and st.button("Generate Visualization"):
                 with st.spinner("Creating document visualization..."):
                     try:
-                        chunks, _ = self.vector_store.process_document(st.session_state.doc_content)
-                        st.session_state.embedding_fig = self.vector_store.create_interactive_graph()
+                        st.session_state.embedding_fig = _build_graph_json(
+                            st.session_state.doc_hash, st.session_state.doc_content
+                        )
                         st.success("Visualization created!")
                     except Exception as e:
                         st.error(f"Failed to create visualization: {str(e)}")
+        
+        # Show the cached visualization without rebuilding or re-serializing it
+        if st.session_state.embedding_fig:
+            import plotly.io as pio
+            with st.expander("Document Visualization", expanded=False):
+                st.plotly_chart(pio.from_json(st.session_state.embedding_fig), use_container_width=True)
 
     def render_token_analysis(self):
         """Render the document split analysis interface"""
@@ -359,8 +793,6 @@ class StreamlitApp:
             return
         
         try:
-            from transformers import BertTokenizer
-            tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
             total_tokens = st.session_state.total_tokens
             
             # Add max token size input
@@ -373,8 +805,11 @@ class StreamlitApp:
                 help="Specify the maximum number of tokens per document split"
             )
             
-            # Create document splits
-            splits = self.create_document_splits(st.session_state.doc_content, tokenizer, max_chunk_size)
+            # Create document splits; slider ticks back to a seen size hit the cache
+            splits = _split_document(
+                st.session_state.doc_hash, st.session_state.doc_content,
+                st.session_state.token_starts, max_chunk_size
+            )
             
             # Display analysis
             num_splits = len(splits)
@@ -433,20 +868,10 @@ class StreamlitApp:
             )
             
             # Model selection
-            model_options = [
-                "DeepSeek-R1-Distill-Llama-70B",
-                "DeepSeek-R1",
-                "Llama-3.1-Tulu-3-405B",
-                "Meta-Llama-3.3-70B-Instruct",
-                "Meta-Llama-3.1-405B-Instruct",
-                "Meta-Llama-2-70B-Chat",
-                "Meta-Llama-2-13B-Chat",
-                "Meta-Llama-2-7B-Chat"
-            ]
             selected_model = st.selectbox(
                 "Model",
-                options=model_options,
-                index=model_options.index(st.session_state.selected_model),
+                options=MODEL_OPTIONS,
+                index=MODEL_INDEX.get(st.session_state.selected_model, 0),
                 key="model_selector"
             )
             st.session_state.selected_model = selected_model
@@ -472,24 +897,17 @@ class StreamlitApp:
             if uploaded_file is None:
                 return False
             
-            # Save uploaded file
-            file_path = os.path.join(self.temp_dir, uploaded_file.name)
-            with open(file_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
-            
-            logger.info(f"Saved file to: {file_path}")
-            
-            # Process the document content
-            content = self.document_processor.extract_text(file_path)
-            
-            # Calculate total tokens
-            from transformers import BertTokenizer
-            tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
-            total_tokens = len(tokenizer.encode(content, add_special_tokens=False))
+            # Reruns and re-uploads of the same content are served from cache
+            file_bytes = uploaded_file.getbuffer()
+            file_hash = hashlib.blake2b(file_bytes, digest_size=16).hexdigest()
+            content, token_starts = _extract_and_tokenize(file_hash, uploaded_file.name, file_bytes)
+            total_tokens = len(token_starts)
             
             # Store in session state
             st.session_state.doc_content = content
+            st.session_state.doc_hash = hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
             st.session_state.total_tokens = total_tokens
+            st.session_state.token_starts = token_starts
             logger.info(f"Processed document content: {len(content)} characters, {total_tokens} tokens")
             
             return True
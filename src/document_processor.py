@@ -1,14 +1,75 @@
 #!/usr/bin/env python3
 
 import os
+import io
+import re
 import json
 import PyPDF2
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from loguru import logger
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, BinaryIO, List
+
+def _extract_page_range(pdf_bytes: bytes, start: int, stop: int) -> List[str]:
+    """
+    Extract the text of pages [start, stop) from a PDF held in memory
+    
+    Runs in a worker process, so it parses its own copy of the document.
+    
+    Args:
+        pdf_bytes: Raw PDF file content
+        start: First page to extract
+        stop: Page to stop before
+        
+    Returns:
+        List[str]: Text of each page in the range
+    """
+    pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+    return [pdf_reader.pages[page_num].extract_text() for page_num in range(start, stop)]
+
+_SPACES_RE = re.compile(r"[ \t]+")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+def _strip_boilerplate(pages: List[str], min_pages: int = 3) -> List[str]:
+    """
+    Compact whitespace and drop running headers/footers from extracted pages
+    
+    A line is treated as boilerplate when it appears on more than half of the
+    pages, which catches repeated titles, footers and notices.
+    
+    Args:
+        pages: Text of each page
+        min_pages: Fewest pages for which repeated lines are removed
+        
+    Returns:
+        List[str]: Cleaned text of each page
+    """
+    pages = [_BLANK_LINES_RE.sub("\n\n", _SPACES_RE.sub(" ", page or "")) for page in pages]
+    if len(pages) < min_pages:
+        return pages
+    
+    # Count each distinct line once per page
+    line_counts = Counter(
+        line for page in pages for line in {l.strip() for l in page.splitlines()} if line
+    )
+    repeated = {line for line, count in line_counts.items() if count > len(pages) / 2}
+    if not repeated:
+        return pages
+    
+    return [
+        "\n".join(line for line in page.splitlines() if line.strip() not in repeated)
+        for page in pages
+    ]
+
+# Common keys that might contain text content, in order of preference
+TEXT_KEYS = ('text', 'content', 'body', 'description', 'message')
 
 class DocumentProcessor:
     """Class for processing and extracting text from various document formats"""
     
+    # Below this many pages, worker start-up costs more than it saves
+    PARALLEL_MIN_PAGES = 32
+    
     def __init__(self):
         """Initialize the document processor"""
         self.supported_formats = {
@@ -53,29 +114,74 @@ class DocumentProcessor:
             str: Extracted text content
         """
         try:
-            text_content = []
-            
             with open(file_path, 'rb') as file:
-                # Create PDF reader object
-                pdf_reader = PyPDF2.PdfReader(file)
-                
-                # Get number of pages
-                num_pages = len(pdf_reader.pages)
-                logger.info(f"Processing PDF with {num_pages} pages")
-                
-                # Extract text from each page
-                for page_num in range(num_pages):
-                    page = pdf_reader.pages[page_num]
-                    text_content.append(page.extract_text())
-                    logger.debug(f"Processed page {page_num + 1}/{num_pages}")
-            
-            # Join all text content
-            return '\n'.join(text_content)
+                return self.extract_pdf_text(file)
             
         except Exception as e:
             logger.error(f"Error processing PDF {file_path}: {str(e)}")
             raise
     
+    def extract_pdf_text(self, stream: BinaryIO) -> str:
+        """
+        Extract text from an open PDF stream, without needing a file on disk
+        
+        Args:
+            stream: Binary file-like object positioned at the start of the PDF
+            
+        Returns:
+            str: Extracted text content
+        """
+        pdf_bytes = stream.read()
+        
+        # Create PDF reader object
+        pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+        
+        # Get number of pages
+        num_pages = len(pdf_reader.pages)
+        logger.info(f"Processing PDF with {num_pages} pages")
+        
+        text_content = None
+        workers = min(os.cpu_count() or 1, num_pages // self.PARALLEL_MIN_PAGES)
+        if workers > 1:
+            try:
+                text_content = self._extract_pages_parallel(pdf_bytes, num_pages, workers)
+            except Exception as e:
+                logger.warning(f"Parallel PDF extraction failed, extracting serially: {str(e)}")
+        
+        if text_content is None:
+            # Extract text from each page
+            text_content = []
+            for page_num in range(num_pages):
+                page = pdf_reader.pages[page_num]
+                text_content.append(page.extract_text())
+                logger.debug(f"Processed page {page_num + 1}/{num_pages}")
+        
+        # Join all text content, minus repeated headers/footers and whitespace runs,
+        # so less of it has to be chunked and embedded
+        return '\n'.join(_strip_boilerplate(text_content))
+    
+    def _extract_pages_parallel(self, pdf_bytes: bytes, num_pages: int, workers: int) -> List[str]:
+        """
+        Extract page text across worker processes, one contiguous page range per worker
+        
+        Args:
+            pdf_bytes: Raw PDF file content
+            num_pages: Number of pages in the PDF
+            workers: Number of worker processes
+            
+        Returns:
+            List[str]: Text of every page, in page order
+        """
+        bounds = [num_pages * i // workers for i in range(workers + 1)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            ranges = executor.map(
+                _extract_page_range,
+                [pdf_bytes] * workers,
+                bounds[:-1],
+                bounds[1:]
+            )
+            return [text for page_texts in ranges for text in page_texts]
+    
     def _process_json(self, file_path: str) -> str:
         """
         Process a JSON file and extract text content
@@ -121,35 +227,34 @@ class DocumentProcessor:
         """
         Extract text content from a dictionary
         
+        Walks nested dicts and lists iteratively, so deeply nested JSON can't
+        exhaust the recursion limit.
+        
         Args:
             data: Dictionary containing text content
             
         Returns:
             str: Extracted text content
         """
-        # Common keys that might contain text content
-        text_keys = ['text', 'content', 'body', 'description', 'message']
-        
-        # First try to find direct text content
-        for key in text_keys:
-            if key in data and isinstance(data[key], str):
-                return data[key]
-        
-        # If no direct text content found, try to find nested content
-        for value in data.values():
-            if isinstance(value, dict):
-                return self._extract_text_from_dict(value)
-            elif isinstance(value, list):
-                text_parts = []
-                for item in value:
-                    if isinstance(item, dict):
-                        text_parts.append(self._extract_text_from_dict(item))
-                    elif isinstance(item, str):
-                        text_parts.append(item)
-                return '\n'.join(text_parts)
+        text_parts = []
+        # Pop from the end, so children are pushed reversed to keep document order
+        stack = [data]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, str):
+                text_parts.append(node)
+            elif isinstance(node, list):
+                stack.extend(reversed(node))
+            elif isinstance(node, dict):
+                # A node's own text field wins over anything nested beneath it
+                text = next((node[key] for key in TEXT_KEYS if isinstance(node.get(key), str)), None)
+                if text is not None:
+                    text_parts.append(text)
+                else:
+                    stack.extend(reversed([v for v in node.values() if isinstance(v, (dict, list))]))
         
         # If no text content found, convert the entire dictionary to string
-        return str(data)
+        return '\n'.join(text_parts) if text_parts else str(data)
 
 # Example usage
 if __name__ == "__main__":
@@ -4,7 +4,7 @@ from typing import List, Optional, Dict
 from pathlib import Path
 from loguru import logger
 import requests
-import json
+import orjson
 import os
 import asyncio
 import aiohttp
@@ -18,9 +18,40 @@ class SambanovaClient:
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
+        # Pooled sessions, one per event loop: a session only works on the loop it was created on
+        self._sessions: Dict[asyncio.AbstractEventLoop, aiohttp.ClientSession] = {}
         
-    async def chat_completion(self, user_message: str, system_message: str = "Answer the question in a couple sentences.") -> str:
-        """Get chat completion from SambaNova API"""
+    async def __aenter__(self) -> "SambanovaClient":
+        return self
+    
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Pooled session for the running loop, kept for the client's lifetime, so TLS setup is paid once per loop"""
+        loop = asyncio.get_running_loop()
+        
+        # Drop sessions whose loop has already been shut down (e.g. by asyncio.run)
+        for stale_loop in [l for l in self._sessions if l.is_closed()]:
+            del self._sessions[stale_loop]
+        
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=100, keepalive_timeout=60)
+            )
+            self._sessions[loop] = session
+        return session
+    
+    async def aclose(self) -> None:
+        """Close the running loop's pooled session"""
+        session = self._sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None and not session.closed:
+            await session.close()
+        
+    async def chat_completion(self, user_message: str, system_message: str = "Answer the question in a couple sentences.",
+                              session: Optional[aiohttp.ClientSession] = None) -> str:
+        """Get chat completion from SambaNova API, on the pooled session unless one is given"""
         payload = {
             "messages": [
                 {"role": "system", "content": system_message},
@@ -33,34 +64,49 @@ class SambanovaClient:
         }
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    self.base_url,
-                    headers=self.headers,
-                    json=payload
-                ) as response:
-                    full_response = ""
-                    async for line in response.content:
-                        if line:
-                            try:
-                                data = json.loads(line)
-                                if "choices" in data:
-                                    content = data["choices"][0].get("delta", {}).get("content", "")
-                                    full_response += content
-                            except json.JSONDecodeError:
-                                continue
-                    
-                    return full_response.strip()
+            return await self._post_completion(session or await self._get_session(), payload)
                     
         except Exception as e:
             logger.error(f"Error in chat completion: {str(e)}")
             raise
 
+    async def _post_completion(self, session: aiohttp.ClientSession, payload: Dict) -> str:
+        """Post a completion request and collect the streamed response"""
+        async with session.post(
+            self.base_url,
+            headers=self.headers,
+            json=payload
+        ) as response:
+            parts = []
+            buffer = bytearray()
+            async for chunk in response.content.iter_any():
+                buffer += chunk
+                # Only complete lines are parsed; a frame split across chunks waits for the rest
+                *lines, tail = buffer.split(b"\n")
+                buffer = bytearray(tail)
+                for line in lines:
+                    if not line.startswith(b"data:"):
+                        continue  # blank separators, comments and keep-alives
+                    payload = line[5:].strip()
+                    if payload == b"[DONE]":
+                        return "".join(parts).strip()
+                    try:
+                        data = orjson.loads(payload)
+                    except orjson.JSONDecodeError:
+                        logger.warning(f"Skipping malformed stream event: {payload[:100]!r}")
+                        continue
+                    if data.get("choices"):
+                        parts.append(data["choices"][0].get("delta", {}).get("content") or "")
+            
+            return "".join(parts).strip()
+
 class DocumentQuerier:
     def __init__(self, docs_dir: Path, collection_name: str):
         self.docs_dir = docs_dir
         self.collection_name = collection_name
         self.sambanova = SambanovaClient()
+        # Reused by query() so the client's pooled session outlives each call
+        self._loop = asyncio.new_event_loop()
         
     async def aquery(self, query_text: str) -> str:
         """Async query method"""
@@ -75,6 +121,22 @@ class DocumentQuerier:
             logger.error(f"Query error: {str(e)}")
             raise
             
+    async def aquery_many(self, queries: List[str], concurrency: int = 8) -> List[str]:
+        """Answer several queries concurrently over the client's connection pool"""
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def answer(query_text: str) -> str:
+            async with semaphore:
+                return await self.aquery(query_text)
+        
+        return await asyncio.gather(*[answer(q) for q in queries])
+            
     def query(self, query_text: str) -> str:
         """Synchronous query wrapper"""
-        return asyncio.run(self.aquery(query_text))
\ No newline at end of file
+        # Unlike asyncio.run, the loop (and the session bound to it) survives between calls
+        return self._loop.run_until_complete(self.aquery(query_text))
+    
+    def close(self) -> None:
+        """Close the pooled session and the event loop behind query()"""
+        self._loop.run_until_complete(self.sambanova.aclose())
+        self._loop.close()
\ No newline at end of file
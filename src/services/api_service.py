@@ -1,12 +1,11 @@
 from typing import Optional
 import os
 import json
+import hashlib
 import logging
 from pathlib import Path
 from cryptography.fernet import Fernet
 import base64
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +15,8 @@ class APIService:
     def __init__(self):
         self.key_file = Path("data/api_key.enc")
         self.salt_file = Path("data/salt.key")
+        # Derived keys by blake2b(password + salt); process memory only, never persisted
+        self._key_cache: dict[bytes, bytearray] = {}
         self._ensure_data_dir()
         
     def _ensure_data_dir(self):
@@ -38,16 +39,24 @@ class APIService:
         else:
             salt = self.salt_file.read_bytes()
             
-        # Generate key using PBKDF2
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=salt,
-            iterations=100000,
-        )
-        key = base64.urlsafe_b64encode(kdf.derive(password.encode()))
+        cache_key = hashlib.blake2b(password.encode() + salt, digest_size=32).digest()
+        cached = self._key_cache.get(cache_key)
+        if cached is not None:
+            return bytes(cached)
+            
+        # Generate key using PBKDF2 via hashlib's OpenSSL binding; same
+        # derivation as before, so existing key files still decrypt
+        derived = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, 100000, dklen=32)
+        key = base64.urlsafe_b64encode(derived)
+        self._key_cache[cache_key] = bytearray(key)
         return key
         
+    def clear_cache(self):
+        """Zero and drop all cached derived keys."""
+        for key in self._key_cache.values():
+            key[:] = bytes(len(key))
+        self._key_cache.clear()
+        
     def save_api_key(self, api_key: str, password: str) -> bool:
         """Save the API key securely.
         
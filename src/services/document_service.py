@@ -1,23 +1,114 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator
 import numpy as np
 from datetime import datetime
 import logging
+import orjson
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
 from pathlib import Path
 import tempfile
 import os
+
+# Only effective if torch hasn't already been imported elsewhere in the process
+os.environ.setdefault("OMP_NUM_THREADS", str(os.cpu_count()))
+os.environ.setdefault("MKL_NUM_THREADS", str(os.cpu_count()))
+
 from transformers import AutoTokenizer, AutoModel
 import torch
 
 logger = logging.getLogger(__name__)
 
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Cached tokenizations older than this are purged when the cache is opened
+TOKEN_CACHE_TTL = 30 * 24 * 3600
+
 class DocumentService:
     """Service class for handling document processing operations."""
     
-    def __init__(self):
-        self.tokenizer = AutoTokenizer.from_pretrained("sentence-transformers/all-MiniLM-L6-v2")
-        self.model = AutoModel.from_pretrained("sentence-transformers/all-MiniLM-L6-v2")
+    def __init__(self, use_onnx: bool = False):
+        self.tokenizer = AutoTokenizer.from_pretrained(EMBEDDING_MODEL)
+        self.device = torch.device(
+            "cuda" if torch.cuda.is_available()
+            else "mps" if torch.backends.mps.is_available()
+            else "cpu"
+        )
+        if self.device.type == "cpu":
+            self._configure_cpu_threads()
+        self.model = self._load_onnx_model() if use_onnx else None
+        if self.model is None:
+            self.model = AutoModel.from_pretrained(EMBEDDING_MODEL)
+            self.model.to(self.device)
+            if self.device.type == "cuda":
+                self.model.half()
+            self.model.eval()
+        else:
+            self.device = torch.device("cpu")
         self.chunk_size = 512
         self.chunk_overlap = 50
+        self.batch_size = 32
+        # Larger files are streamed and their full text is not kept in the result
+        self.max_inline_content = 8 << 20
+        self.cache_path = Path("data/embedding_cache.db")
+        self._cache_lock = threading.Lock()
+        self._cache = self._open_embedding_cache()
+        # Most recently used token streams by content hash, in front of the disk cache
+        self._token_cache: OrderedDict[str, np.ndarray] = OrderedDict()
+        self.token_cache_size = 32
+        
+    def _configure_cpu_threads(self) -> None:
+        """Use every core for intra-op parallelism and a single inter-op thread."""
+        torch.set_num_threads(os.cpu_count())
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # Can only be set before any inter-op work has started in the process
+            logger.debug("torch inter-op thread count already fixed; leaving as is")
+        
+    def _open_embedding_cache(self) -> Optional[sqlite3.Connection]:
+        """Open the on-disk embedding cache, creating it if needed.
+        
+        Returns:
+            SQLite connection, or None if the cache can't be opened
+        """
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            # Shared across Streamlit script threads; writes are serialized by _cache_lock
+            conn = sqlite3.connect(self.cache_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "hash TEXT, model TEXT, dim INT, vec BLOB, PRIMARY KEY (hash, model))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tokens ("
+                "hash TEXT, model TEXT, ids BLOB, created REAL, PRIMARY KEY (hash, model))"
+            )
+            conn.execute("DELETE FROM tokens WHERE created < ?", (time.time() - TOKEN_CACHE_TTL,))
+            conn.commit()
+            return conn
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache disabled: {str(e)}")
+            return None
+        
+    def _load_onnx_model(self):
+        """Export the embedding model to ONNX Runtime for faster CPU inference.
+        
+        Returns:
+            ORT feature-extraction model, or None if optimum isn't installed
+        """
+        try:
+            from optimum.onnxruntime import ORTModelForFeatureExtraction
+        except ImportError:
+            logger.warning("use_onnx requested but optimum[onnxruntime] is not installed; using PyTorch")
+            return None
+        return ORTModelForFeatureExtraction.from_pretrained(
+            EMBEDDING_MODEL, export=True, provider="CPUExecutionProvider"
+        )
         
     def process_document(self, file_path: str) -> Optional[Dict[str, Any]]:
         """Process a document and extract its content and metadata.
@@ -29,20 +120,26 @@ class DocumentService:
             Dictionary containing document content and metadata, or None if processing fails
         """
         try:
-            # Read document content
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
             # Extract metadata
             file_name = os.path.basename(file_path)
-            file_size = os.path.getsize(file_path)
-            created_at = datetime.fromtimestamp(os.path.getctime(file_path))
+            stat = os.stat(file_path)
+            file_size = stat.st_size
+            created_at = datetime.fromtimestamp(stat.st_ctime)
             
-            # Split content into chunks
-            chunks = self._split_into_chunks(content)
+            # Stream the file as chunks of token IDs and embed them a group at
+            # a time; the decoded text is kept for storage
+            chunks = []
+            batches = []
+            chunk_iter = self._iter_file_chunks(file_path)
+            while batch := list(islice(chunk_iter, self.batch_size * 8)):
+                chunks.extend(self.tokenizer.decode(ids) for ids in batch)
+                batches.append(self._embed_token_ids(batch))
+            embeddings = np.concatenate(batches) if batches else self._embed_token_ids([])
             
-            # Generate embeddings for chunks
-            embeddings = self._generate_embeddings(chunks)
+            content = None
+            if file_size <= self.max_inline_content:
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    content = f.read()
             
             return {
                 'content': content,
@@ -60,26 +157,187 @@ class DocumentService:
             logger.error(f"Failed to process document {file_path}: {str(e)}")
             return None
     
-    def _split_into_chunks(self, text: str) -> List[str]:
-        """Split text into overlapping chunks.
+    def _iter_chunks(self, file_path: str, block_size: int = 1 << 20) -> Iterator[List[int]]:
+        """Stream a text file as overlapping chunks of token IDs.
+        
+        Yields the same chunks as _tokenize_into_chunks on the whole file,
+        while holding only about one block of text and tokens at a time.
+        
+        Args:
+            file_path: Path to a UTF-8 text file
+            block_size: Characters read per block
+            
+        Yields:
+            Token ID lists, without special tokens
+        """
+        size = self.chunk_size - self.tokenizer.num_special_tokens_to_add()
+        tokens: List[int] = []
+        carry = ''
+        emitted = False
+        
+        with open(file_path, 'r', encoding='utf-8') as f:
+            while True:
+                block = f.read(block_size)
+                text = carry + block
+                carry = ''
+                if block:
+                    # Hold back the trailing partial word so it isn't split across blocks
+                    cut = max(text.rfind(' '), text.rfind('\n'), text.rfind('\t'), 0)
+                    text, carry = text[:cut], text[cut:]
+                tokens.extend(self.tokenizer.encode(text, add_special_tokens=False))
+                
+                start = 0
+                while len(tokens) - start >= size:
+                    yield tokens[start:start + size]
+                    start += size - self.chunk_overlap
+                    emitted = True
+                del tokens[:start]
+                
+                if not block:
+                    break
+        
+        # The first chunk_overlap tokens left over were already in the last chunk
+        if len(tokens) > (self.chunk_overlap if emitted else 0):
+            yield tokens
+    
+    def _iter_file_chunks(self, file_path: str) -> Iterator[List[int]]:
+        """Stream a text file as overlapping chunks of token IDs, reusing cached tokenization.
+        
+        Args:
+            file_path: Path to a UTF-8 text file
+            
+        Yields:
+            Token ID lists, without special tokens
+        """
+        key = self._file_hash(file_path)
+        tokens = self._token_cache_get(key)
+        if tokens is not None:
+            for window in self._windows(tokens):
+                yield window.tolist()
+            return
+        
+        # Rebuild the flat token stream from the windows by dropping each overlap
+        parts = []
+        for ids in self._iter_chunks(file_path):
+            parts.append(np.asarray(ids[self.chunk_overlap:] if parts else ids, dtype=np.int32))
+            yield ids
+        self._token_cache_put(key, np.concatenate(parts) if parts else np.empty(0, dtype=np.int32))
+    
+    def _tokenize_into_chunks(self, text: str) -> List[List[int]]:
+        """Tokenize text once and slice it into overlapping chunks of token IDs.
         
         Args:
             text: Text to split
             
         Returns:
-            List of text chunks
+            List of token ID lists, without special tokens
         """
-        tokens = self.tokenizer.encode(text)
-        chunks = []
+        key = hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+        tokens = self._token_cache_get(key)
+        if tokens is None:
+            tokens = np.asarray(self.tokenizer.encode(text, add_special_tokens=False), dtype=np.int32)
+            self._token_cache_put(key, tokens)
+        return [window.tolist() for window in self._windows(tokens)]
+    
+    def _windows(self, tokens: np.ndarray) -> Iterator[np.ndarray]:
+        """Slice a token stream into overlapping chunk windows.
+        
+        Args:
+            tokens: Token IDs of the whole text
+            
+        Yields:
+            Token ID windows sized to leave room for special tokens
+        """
+        # Leave room for the [CLS]/[SEP] tokens added at embedding time
+        size = self.chunk_size - self.tokenizer.num_special_tokens_to_add()
         start = 0
         
         while start < len(tokens):
-            end = start + self.chunk_size
-            chunk = tokens[start:end]
-            chunks.append(self.tokenizer.decode(chunk))
+            end = start + size
+            yield tokens[start:end]
+            if end >= len(tokens):
+                break
             start = end - self.chunk_overlap
+    
+    @staticmethod
+    def _file_hash(file_path: str) -> str:
+        """Hash a file's contents without reading it into memory at once.
+        
+        Args:
+            file_path: Path to the file
             
-        return chunks
+        Returns:
+            Hex digest identifying the content
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        with open(file_path, 'rb') as f:
+            while block := f.read(1 << 20):
+                digest.update(block)
+        return digest.hexdigest()
+    
+    def _token_cache_get(self, key: str) -> Optional[np.ndarray]:
+        """Look up a cached token stream, first in memory, then on disk.
+        
+        Args:
+            key: Content hash
+            
+        Returns:
+            Token IDs, or None on a miss
+        """
+        with self._cache_lock:
+            tokens = self._token_cache.get(key)
+            if tokens is not None:
+                self._token_cache.move_to_end(key)
+                return tokens
+            if self._cache is None:
+                return None
+            row = self._cache.execute(
+                "SELECT ids FROM tokens WHERE hash = ? AND model = ?", (key, EMBEDDING_MODEL)
+            ).fetchone()
+        if row is None:
+            return None
+        tokens = np.frombuffer(row[0], dtype=np.int32)
+        self._remember_tokens(key, tokens)
+        return tokens
+    
+    def _token_cache_put(self, key: str, tokens: np.ndarray) -> None:
+        """Cache a token stream in memory and on disk.
+        
+        Args:
+            key: Content hash
+            tokens: Token IDs as int32
+        """
+        self._remember_tokens(key, tokens)
+        if self._cache is None:
+            return
+        try:
+            with self._cache_lock:
+                self._cache.execute(
+                    "INSERT OR REPLACE INTO tokens VALUES (?, ?, ?, ?)",
+                    (key, EMBEDDING_MODEL, tokens.tobytes(), time.time())
+                )
+                self._cache.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to write token cache: {str(e)}")
+    
+    def _remember_tokens(self, key: str, tokens: np.ndarray) -> None:
+        """Add a token stream to the in-memory LRU, evicting the oldest entries."""
+        with self._cache_lock:
+            self._token_cache[key] = tokens
+            self._token_cache.move_to_end(key)
+            while len(self._token_cache) > self.token_cache_size:
+                self._token_cache.popitem(last=False)
+    
+    def _split_into_chunks(self, text: str) -> List[str]:
+        """Split text into overlapping chunks.
+        
+        Args:
+            text: Text to split
+            
+        Returns:
+            List of text chunks
+        """
+        return [self.tokenizer.decode(ids) for ids in self._tokenize_into_chunks(text)]
     
     def _generate_embeddings(self, texts: List[str]) -> np.ndarray:
         """Generate embeddings for a list of texts.
@@ -90,15 +348,117 @@ class DocumentService:
         Returns:
             Numpy array of embeddings
         """
-        embeddings = []
+        size = self.chunk_size - self.tokenizer.num_special_tokens_to_add()
+        id_lists = self.tokenizer(
+            texts, add_special_tokens=False, truncation=True, max_length=size
+        )["input_ids"]
+        return self._embed_token_ids(id_lists)
+    
+    def _embed_token_ids(self, id_lists: List[List[int]]) -> np.ndarray:
+        """Generate embeddings for pre-tokenized chunks, reusing cached vectors.
+        
+        Args:
+            id_lists: Token ID lists without special tokens
+            
+        Returns:
+            Numpy array of embeddings, in input order
+        """
+        if self._cache is None or not id_lists:
+            return self._compute_embeddings(id_lists)
+
+        keys = [
+            hashlib.blake2b(np.asarray(ids, dtype=np.int32).tobytes(), digest_size=16).hexdigest()
+            for ids in id_lists
+        ]
+        cached = self._cache_get(set(keys))
+        misses = [i for i, key in enumerate(keys) if key not in cached]
+        logger.debug(f"Embedding cache: {len(keys) - len(misses)} hits, {len(misses)} misses")
+
+        embeddings = np.empty((len(keys), self.model.config.hidden_size), dtype=np.float32)
+        for i, key in enumerate(keys):
+            if key in cached:
+                embeddings[i] = cached[key]
+        if misses:
+            computed = self._compute_embeddings([id_lists[i] for i in misses])
+            embeddings[misses] = computed
+            self._cache_put({keys[i]: vec for i, vec in zip(misses, computed)})
+        return embeddings
+    
+    def _cache_get(self, keys: set) -> Dict[str, np.ndarray]:
+        """Fetch cached embeddings for the given chunk hashes.
         
-        for text in texts:
-            inputs = self.tokenizer(text, return_tensors="pt", padding=True, truncation=True)
-            with torch.no_grad():
-                outputs = self.model(**inputs)
-                embeddings.append(outputs.last_hidden_state.mean(dim=1).squeeze().numpy())
+        Args:
+            keys: Chunk hashes to look up
+            
+        Returns:
+            Mapping of hash to embedding for the hashes found
+        """
+        found = {}
+        keys = list(keys)
+        with self._cache_lock:
+            # Stay under SQLite's host-parameter limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._cache.execute(
+                    f"SELECT hash, vec FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(batch))})",
+                    [EMBEDDING_MODEL, *batch]
+                ).fetchall()
+                for key, vec in rows:
+                    found[key] = np.frombuffer(vec, dtype=np.float16).astype(np.float32)
+        return found
+    
+    def _cache_put(self, vectors: Dict[str, np.ndarray]) -> None:
+        """Store embeddings in the cache as float16.
         
-        return np.array(embeddings)
+        Args:
+            vectors: Mapping of chunk hash to embedding
+        """
+        rows = [
+            (key, EMBEDDING_MODEL, vec.shape[0], vec.astype(np.float16).tobytes())
+            for key, vec in vectors.items()
+        ]
+        try:
+            with self._cache_lock:
+                self._cache.executemany("INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+                self._cache.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to write embedding cache: {str(e)}")
+    
+    def _compute_embeddings(self, id_lists: List[List[int]]) -> np.ndarray:
+        """Run the embedding model over pre-tokenized chunks.
+        
+        Args:
+            id_lists: Token ID lists without special tokens
+            
+        Returns:
+            Numpy array of embeddings, in input order
+        """
+        if not id_lists:
+            return np.empty((0, self.model.config.hidden_size), dtype=np.float32)
+
+        # Batch chunks of similar length together so each batch pads only to
+        # its own longest member rather than the longest chunk overall
+        order = np.argsort([len(ids) for ids in id_lists], kind="stable")
+
+        batches = []
+        for start in range(0, len(order), self.batch_size):
+            inputs = self.tokenizer.pad(
+                {"input_ids": [
+                    self.tokenizer.build_inputs_with_special_tokens(id_lists[i])
+                    for i in order[start:start + self.batch_size]
+                ]},
+                return_tensors="pt"
+            ).to(self.device)
+            with torch.inference_mode():
+                hidden = self.model(**inputs).last_hidden_state
+            # Mean-pool over real tokens only so padding doesn't dilute the embedding
+            mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1)
+            batches.append(pooled.float().cpu().numpy())
+
+        inverse = np.empty_like(order)
+        inverse[order] = np.arange(len(order))
+        return np.concatenate(batches)[inverse]
     
     def save_processed_document(self, document: Dict[str, Any], output_dir: str) -> Optional[str]:
         """Save processed document to disk.
@@ -114,18 +474,20 @@ class DocumentService:
             # Create output directory if it doesn't exist
             os.makedirs(output_dir, exist_ok=True)
             
-            # Generate output filename
+            # Generate output filename; text and metadata go in a JSON sidecar
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_file = os.path.join(output_dir, f"processed_{timestamp}.npz")
-            
-            # Save document data
-            np.savez(
-                output_file,
-                content=document['content'],
-                chunks=document['chunks'],
-                embeddings=document['embeddings'],
-                metadata=document['metadata']
-            )
+            output_file = os.path.join(output_dir, f"processed_{timestamp}.npy")
+            sidecar_file = os.path.join(output_dir, f"processed_{timestamp}.json")
+            
+            # Save embeddings as float16 so they can be memory-mapped on load
+            with open(output_file, 'wb') as f:
+                np.save(f, np.asarray(document['embeddings'], dtype=np.float16))
+            with open(sidecar_file, 'wb') as f:
+                f.write(orjson.dumps({
+                    'content': document['content'],
+                    'chunks': document['chunks'],
+                    'metadata': document['metadata']
+                }))
             
             logger.info(f"Successfully saved processed document to {output_file}")
             return output_file
@@ -144,13 +506,11 @@ class DocumentService:
             Dictionary containing document data or None if loading fails
         """
         try:
-            data = np.load(file_path, allow_pickle=True)
-            return {
-                'content': data['content'].item(),
-                'chunks': data['chunks'].tolist(),
-                'embeddings': data['embeddings'],
-                'metadata': data['metadata'].item()
-            }
+            with open(os.path.splitext(file_path)[0] + '.json', 'rb') as f:
+                document = orjson.loads(f.read())
+            # Pages of the embedding matrix are read on demand; never unpickle
+            document['embeddings'] = np.load(file_path, mmap_mode='r', allow_pickle=False)
+            return document
         except Exception as e:
             logger.error(f"Failed to load processed document {file_path}: {str(e)}")
             return None 
\ No newline at end of file
@@ -5,39 +5,65 @@ from qdrant_client import QdrantClient
 from qdrant_client.http import models
 from qdrant_client.http.models import Distance, VectorParams, HnswConfigDiff
 import logging
+import random
+import time
 from src.config import config
 
 logger = logging.getLogger(__name__)
 
+# int8 copies of the vectors stay in RAM; the float32 originals live on disk
+INT8_QUANTIZATION = models.ScalarQuantization(
+    scalar=models.ScalarQuantizationConfig(
+        type=models.ScalarType.INT8,
+        quantile=0.99,
+        always_ram=True
+    )
+)
+
+# Collections up to this size are searched in-process instead of over the network
+LOCAL_SEARCH_MAX_POINTS = 100_000
+
+# Re-rank the int8 candidates with the original vectors to recover recall
+RESCORE_SEARCH_PARAMS = models.SearchParams(
+    quantization=models.QuantizationSearchParams(rescore=True)
+)
+
 class QdrantService:
     """Service class for handling Qdrant operations."""
     
-    def __init__(self):
+    def __init__(self, vector_size: int = 384):
         self.client: Optional[QdrantClient] = None
         self.is_connected = False
+        self.vector_size = vector_size
         
-    def connect(self, max_retries: int = 5, retry_delay: int = 5) -> bool:
+    def connect(self, max_retries: int = 5, retry_delay: float = 0.5, max_delay: float = 8.0) -> bool:
         """Connect to Qdrant with retries.
         
         Args:
             max_retries: Maximum number of connection attempts
-            retry_delay: Delay between retries in seconds
+            retry_delay: Initial delay between retries in seconds, doubled each attempt
+            max_delay: Upper bound on the delay between retries in seconds
             
         Returns:
             bool: True if connection successful, False otherwise
         """
         qdrant_url = config.get_qdrant_url()
+        self.client = None
         
         for attempt in range(max_retries):
             try:
                 logger.info(f"Connecting to Qdrant at: {qdrant_url} (Attempt {attempt + 1}/{max_retries})")
-                self.client = QdrantClient(
-                    url=qdrant_url,
-                    port=config.qdrant_http_port,
-                    timeout=30.0,
-                    prefer_grpc=False,
-                    verify=config.qdrant_verify_ssl
-                )
+                # Built once and reused by later attempts; only the probe is retried
+                if self.client is None:
+                    self.client = QdrantClient(
+                        url=qdrant_url,
+                        port=config.qdrant_http_port,
+                        grpc_port=config.qdrant_grpc_port,
+                        timeout=30.0,
+                        # HTTPS ingress (App Runner) can't carry gRPC
+                        prefer_grpc=not config.qdrant_https,
+                        verify=config.qdrant_verify_ssl
+                    )
                 # Test the connection
                 self.client.get_collections()
                 self.is_connected = True
@@ -45,8 +71,10 @@ class QdrantService:
                 return True
             except Exception as e:
                 if attempt < max_retries - 1:
-                    logger.warning(f"Failed to connect to Qdrant: {str(e)}. Retrying in {retry_delay} seconds...")
-                    time.sleep(retry_delay)
+                    # Jitter keeps concurrent sessions from retrying in lockstep
+                    delay = min(retry_delay * 2 ** attempt, max_delay) + random.uniform(0, retry_delay)
+                    logger.warning(f"Failed to connect to Qdrant: {str(e)}. Retrying in {delay:.1f} seconds...")
+                    time.sleep(delay)
                 else:
                     logger.error(f"Failed to connect to Qdrant after {max_retries} attempts: {str(e)}")
                     self.is_connected = False
@@ -75,36 +103,38 @@ class QdrantService:
             self.client.recreate_collection(
                 collection_name=collection_name,
                 vectors_config={
-                    "vectors": {
-                        "size": 768,
-                        "distance": "Cosine"
-                    }
-                }
+                    "vectors": VectorParams(size=self.vector_size, distance=Distance.COSINE, on_disk=True)
+                },
+                quantization_config=INT8_QUANTIZATION
             )
             
-            # Prepare points for storage
-            points = []
-            for i, (vector, chunk_text) in enumerate(zip(vectors, chunks)):
-                points.append({
-                    "id": i,
-                    "vector": {
-                        "vectors": vector.tolist()
-                    },
-                    "payload": {
-                        "chunk_index": i,
-                        "text": chunk_text,
-                        "document_name": document_name,
-                        "timestamp": datetime.now().isoformat()
-                    }
-                })
+            # One contiguous float32 matrix instead of a Python list per vector,
+            # unit-normalized here so the server's cosine is a plain dot product
+            matrix = np.ascontiguousarray(np.stack(vectors), dtype=np.float32)
+            matrix /= np.linalg.norm(matrix, axis=-1, keepdims=True)
+            timestamp = datetime.now().isoformat()
+            payloads = [
+                {
+                    "chunk_index": i,
+                    "text": chunk_text,
+                    "document_name": document_name,
+                    "timestamp": timestamp
+                }
+                for i, chunk_text in enumerate(chunks)
+            ]
             
-            # Upload points
-            self.client.upsert(
+            # Upload in pipelined batches rather than one request body
+            self.client.upload_collection(
                 collection_name=collection_name,
-                points=points
+                vectors={"vectors": matrix},
+                payload=payloads,
+                ids=range(len(payloads)),
+                batch_size=256,
+                parallel=4,
+                wait=False
             )
             
-            logger.info(f"Successfully stored {len(points)} vectors in collection {collection_name}")
+            logger.info(f"Successfully stored {len(payloads)} vectors in collection {collection_name}")
             return True
             
         except Exception as e:
@@ -128,16 +158,70 @@ class QdrantService:
             return []
             
         try:
+            query_vector = query_vector / np.linalg.norm(query_vector)
             results = self.client.search(
                 collection_name=collection_name,
-                query_vector=query_vector.tolist(),
-                limit=limit
+                query_vector=("vectors", query_vector.tolist()),
+                limit=limit,
+                search_params=RESCORE_SEARCH_PARAMS
             )
             return results
         except Exception as e:
             logger.error(f"Failed to search vectors: {str(e)}")
             return []
     
+    @staticmethod
+    def build_local_index(embeddings: np.ndarray) -> np.ndarray:
+        """Pack embeddings into the matrix layout search_local expects.
+        
+        Args:
+            embeddings: (N, D) embeddings
+            
+        Returns:
+            Contiguous, L2-normalized (N, D) float16 matrix
+        """
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        matrix = matrix / np.linalg.norm(matrix, axis=-1, keepdims=True)
+        return np.ascontiguousarray(matrix, dtype=np.float16)
+    
+    def search_local(self, query_vector: np.ndarray, embeddings: np.ndarray, chunks: List[str],
+                     document_name: str, limit: int = 5) -> List[Dict[str, Any]]:
+        """Search an in-memory embedding matrix without a round trip to Qdrant.
+        
+        Args:
+            query_vector: Query vector
+            embeddings: Matrix from build_local_index
+            chunks: Chunk texts, row-aligned with embeddings
+            document_name: Name of the document the chunks belong to
+            limit: Maximum number of results
+            
+        Returns:
+            List of similar chunks with scores and payloads, best first
+        """
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / np.linalg.norm(query)
+        # Single GEMV over the contiguous matrix; cosine is a dot product on unit vectors
+        scores = embeddings.astype(np.float32) @ query
+        
+        limit = min(limit, len(scores))
+        if limit == 0:
+            return []
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+        
+        return [
+            {
+                "id": int(i),
+                "score": float(scores[i]),
+                "payload": {
+                    "chunk_index": int(i),
+                    "text": chunks[i],
+                    "document_name": document_name
+                }
+            }
+            for i in top
+        ]
+    
     def get_collection_info(self, collection_name: str) -> Optional[Dict[str, Any]]:
         """Get information about a collection.
         
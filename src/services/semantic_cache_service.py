@@ -0,0 +1,93 @@
+from typing import List, Dict, Any, Optional
+import numpy as np
+from datetime import datetime, timedelta
+import logging
+from transformers import AutoTokenizer, AutoModel
+import torch
+
+logger = logging.getLogger(__name__)
+
+class SemanticCacheService:
+    """Service class for answering near-duplicate queries from cached responses."""
+
+    def __init__(self, similarity_threshold: float = 0.92, ttl_seconds: int = 3600, max_entries: int = 256,
+                 tokenizer=None, model=None, device: Optional[torch.device] = None):
+        """Initialize the cache, sharing an already loaded MiniLM model when given one.
+
+        Args:
+            similarity_threshold: Minimum cosine similarity for a cache hit
+            ttl_seconds: Age after which entries are ignored
+            max_entries: Maximum number of entries kept
+            tokenizer: Tokenizer of an already loaded all-MiniLM-L6-v2, e.g. DocumentService's
+            model: The matching model; PyTorch or ONNX, on any device and precision
+            device: Device the model runs on
+        """
+        if model is None:
+            tokenizer = AutoTokenizer.from_pretrained("sentence-transformers/all-MiniLM-L6-v2")
+            model = AutoModel.from_pretrained("sentence-transformers/all-MiniLM-L6-v2")
+            model.eval()
+            device = None
+        self.tokenizer = tokenizer
+        self.model = model
+        self.device = device or torch.device("cpu")
+        self.similarity_threshold = similarity_threshold
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.max_entries = max_entries
+
+    def embed(self, text: str) -> np.ndarray:
+        """Embed a query as a unit-length vector.
+
+        Args:
+            text: Query text
+
+        Returns:
+            Normalized mean-pooled embedding
+        """
+        inputs = self.tokenizer(text, return_tensors="pt", truncation=True, max_length=256).to(self.device)
+        with torch.inference_mode():
+            hidden = self.model(**inputs).last_hidden_state
+        mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+        # Pool in float32 on the CPU whatever precision and device the model runs at
+        embedding = ((hidden * mask).sum(dim=1) / mask.sum(dim=1)).squeeze(0).float().cpu().numpy()
+        return embedding / np.linalg.norm(embedding)
+
+    def lookup(self, entries: List[Dict[str, Any]], embedding: np.ndarray, scope: str) -> Optional[str]:
+        """Find a cached response for a semantically similar query.
+
+        Args:
+            entries: Cache entries, typically held in session state
+            embedding: Embedding of the incoming query
+            scope: Context the response belongs to (e.g. the document queried)
+
+        Returns:
+            Cached response, or None if no fresh entry is similar enough
+        """
+        cutoff = datetime.now() - self.ttl
+        candidates = [e for e in entries if e['scope'] == scope and e['timestamp'] >= cutoff]
+        if not candidates:
+            return None
+
+        similarities = np.stack([e['embedding'] for e in candidates]) @ embedding
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            return None
+
+        logger.info(f"Semantic cache hit (similarity {similarities[best]:.3f})")
+        return candidates[best]['response']
+
+    def store(self, entries: List[Dict[str, Any]], embedding: np.ndarray, response: str, scope: str) -> None:
+        """Add a response to the cache, evicting the oldest entries past max_entries.
+
+        Args:
+            entries: Cache entries, typically held in session state
+            embedding: Embedding of the query that produced the response
+            response: Response text
+            scope: Context the response belongs to (e.g. the document queried)
+        """
+        entries.append({
+            'embedding': embedding,
+            'response': response,
+            'scope': scope,
+            'timestamp': datetime.now()
+        })
+        del entries[:-self.max_entries]
@@ -1,24 +1,259 @@
 import os
+import re
 import asyncio
+import atexit
+import threading
+from functools import lru_cache
 from loguru import logger
-import openai
-import json
-from typing import Iterator, Union, Dict, Tuple, List, AsyncGenerator
+import orjson
+from typing import Iterator, Union, Dict, Tuple, List, AsyncGenerator, Optional, Any
 import streamlit as st
-import sseclient
-import requests
 from dotenv import load_dotenv
 import aiohttp
+import numpy as np
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Pooled HTTP sessions, one per event loop
+_http_sessions: Dict[asyncio.AbstractEventLoop, aiohttp.ClientSession] = {}
+
+@lru_cache(maxsize=1)
+def _background_loop() -> asyncio.AbstractEventLoop:
+    """
+    Start the process-wide event loop on a daemon thread
+    
+    Streamlit runs every rerun on a fresh script thread, so a loop per thread
+    would be abandoned (with its pooled session) after each click. One loop
+    that outlives the script threads keeps the session and its connections.
+    
+    Returns:
+        asyncio.AbstractEventLoop: The running background loop
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="async-io", daemon=True).start()
+    return loop
+
+def run_async(coro):
+    """
+    Run a coroutine on the process-wide background loop and wait for its result
+    
+    The loop is never torn down, so the pooled session from get_http_session
+    keeps its connections between queries and across reruns. The coroutine
+    runs off the script thread, so it must not call Streamlit.
+    
+    Args:
+        coro: Coroutine to run
+        
+    Returns:
+        The coroutine's result
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop()).result()
+
+def iterate_async(agen: AsyncGenerator) -> Iterator:
+    """
+    Consume an async generator as a plain iterator on the background loop
+    
+    Lets synchronous consumers such as st.write_stream drive async streams.
+    
+    Args:
+        agen: Async generator to consume
+        
+    Yields:
+        Items produced by the async generator
+    """
+    try:
+        while True:
+            try:
+                yield run_async(agen.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        run_async(agen.aclose())
+
+def get_http_session() -> aiohttp.ClientSession:
+    """
+    Get the pooled HTTP session for the running event loop
+    
+    Returns:
+        aiohttp.ClientSession: Session with keep-alive and DNS caching
+    """
+    loop = asyncio.get_running_loop()
+    
+    # Drop sessions whose loop has already been shut down
+    for stale_loop in [l for l in _http_sessions if l.is_closed()]:
+        del _http_sessions[stale_loop]
+    
+    session = _http_sessions.get(loop)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=100, keepalive_timeout=300, ttl_dns_cache=300),
+            # No overall cap on long streams, but fail if the server goes quiet
+            timeout=aiohttp.ClientTimeout(total=None, sock_read=60)
+        )
+        _http_sessions[loop] = session
+    return session
+
+@atexit.register
+def _close_http_sessions():
+    """Close pooled sessions on interpreter exit so connections shut down cleanly"""
+    for loop, session in list(_http_sessions.items()):
+        if session.closed or loop.is_closed():
+            continue
+        if loop.is_running():
+            # The background loop's thread is still alive during atexit
+            asyncio.run_coroutine_threadsafe(session.close(), loop).result(timeout=5)
+        else:
+            loop.run_until_complete(session.close())
+    _http_sessions.clear()
+
+@st.cache_resource(show_spinner=False)
+def get_bert_tokenizer():
+    """
+    Get the BERT tokenizer, loaded once per process
+    
+    Returns:
+        BertTokenizerFast: Rust-backed tokenizer for bert-base-uncased
+    """
+    from transformers import BertTokenizerFast
+    return BertTokenizerFast.from_pretrained('bert-base-uncased')
+
+def get_token_offsets(text: str, tokenizer) -> np.ndarray:
+    """
+    Tokenize text once and return each token's character span
+    
+    Args:
+        text: Text to tokenize
+        tokenizer: Fast (offset-mapping capable) tokenizer
+        
+    Returns:
+        np.ndarray: (n_tokens, 2) array of [start, end) character offsets
+    """
+    encoding = tokenizer(
+        text,
+        add_special_tokens=False,
+        return_offsets_mapping=True,
+        return_attention_mask=False,
+        return_token_type_ids=False
+    )
+    return np.asarray(encoding["offset_mapping"], dtype=np.int64).reshape(-1, 2)
+
+_BREAK_CHARS = ("\n\n", "\n", ". ", " ")
+
+def find_natural_break(text: str, start: int, end: int) -> int:
+    """
+    Find where to cut text[start:end] so the chunk ends on a natural break
+    
+    Args:
+        text: Full text being split
+        start: Start of the candidate window
+        end: End of the candidate window
+        
+    Returns:
+        int: Cut position, just after the strongest break in the window, or end if none
+    """
+    # Separators are tried strongest first, so a paragraph break anywhere in the
+    # window wins over a later line or sentence break
+    for break_char in _BREAK_CHARS:
+        natural_break = text.rfind(break_char, start, end)
+        if natural_break != -1:
+            return natural_break + len(break_char)
+    return end
+
+def create_document_splits(text: str, token_starts: np.ndarray, max_tokens: int) -> List[Dict[str, Any]]:
+    """
+    Split text into chunks of at most max_tokens, preferring natural break points
+    
+    Args:
+        text: Text to split
+        token_starts: Start offset of each token in text, from get_token_offsets
+        max_tokens: Maximum number of tokens per split
+        
+    Returns:
+        List[Dict[str, Any]]: Splits with start, end, tokens and content
+    """
+    num_tokens = len(token_starts)
+    text_length = len(text)
+    
+    splits = []
+    position = 0
+    token = 0
+    while position < text_length:
+        stop_token = token + max_tokens
+        if stop_token >= num_tokens:
+            end = text_length
+        else:
+            # Cut just before the first token that no longer fits, then
+            # snap back to the nearest natural break inside that window
+            end = find_natural_break(text, position, int(token_starts[stop_token]))
+        
+        next_token = int(np.searchsorted(token_starts, end, side='left'))
+        splits.append({
+            "start": position,
+            "end": end,
+            "tokens": next_token - token,
+            "content": text[position:end]
+        })
+        position = end
+        token = next_token
+    
+    return splits
+
+# Only whitespace that never carries meaning: indentation inside pasted or
+# generated code must survive, so runs of spaces within a line are left alone
+_TRAILING_SPACES_RE = re.compile(r"[ \t]+$", re.MULTILINE)
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+def trim_history(messages: List[Dict[str, str]], max_tokens: int = 2048) -> List[Dict[str, str]]:
+    """
+    Keep the leading system message and as many recent messages as fit a token budget
+    
+    Args:
+        messages: Chat messages, oldest first; the last one is the new user turn
+        max_tokens: Token budget for everything except the system message
+        
+    Returns:
+        List[Dict[str, str]]: Trimmed messages with trailing whitespace and blank-line runs removed
+    """
+    messages = [
+        {**m, "content": _BLANK_LINES_RE.sub("\n\n", _TRAILING_SPACES_RE.sub("", m["content"])).strip("\n")}
+        for m in messages
+    ]
+    system = messages[:1] if messages and messages[0]["role"] == "system" else []
+    history = messages[len(system):]
+    if not history:
+        return system
+    
+    # One batched tokenizer call for all message lengths
+    token_counts = [
+        len(ids) for ids in get_bert_tokenizer()(
+            [m["content"] for m in history],
+            add_special_tokens=False,
+            return_attention_mask=False,
+            return_token_type_ids=False
+        )["input_ids"]
+    ]
+    
+    # Walk back from the newest message; the new user turn is always kept
+    kept = 1
+    used = token_counts[-1]
+    for count in reversed(token_counts[:-1]):
+        if used + count > max_tokens:
+            break
+        used += count
+        kept += 1
+    
+    if kept < len(history):
+        logger.debug(f"Trimmed {len(history) - kept} old messages from chat context")
+    return system + history[-kept:]
+
 async def create_streaming_chat_completion(
     messages: List[Dict[str, str]],
     max_tokens: int = 512,
     temperature: float = 0.7,
     top_p: float = 0.95,
-    stream: bool = True
+    stream: bool = True,
+    session: Optional[aiohttp.ClientSession] = None
 ) -> AsyncGenerator[str, None]:
     """
     Create a streaming chat completion using the SambaNova API
@@ -29,6 +264,7 @@ async def create_streaming_chat_completion(
         temperature: Sampling temperature
         top_p: Top-p sampling parameter
         stream: Whether to stream the response
+        session: HTTP session to use, defaults to the pooled session
         
     Yields:
         str: Generated text chunks
@@ -57,66 +293,46 @@ async def create_streaming_chat_completion(
             "Content-Type": "application/json"
         }
         
-        # Make request
-        async with aiohttp.ClientSession() as session:
-            async with session.post(api_url, json=payload, headers=headers) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    raise Exception(f"API request failed: {error_text}")
-                
-                if stream:
-                    # Process streaming response
-                    async for line in response.content:
-                        if line:
-                            try:
-                                # Parse SSE data
-                                line = line.decode('utf-8').strip()
-                                if line.startswith('data: '):
-                                    data = line[6:]
-                                    if data == '[DONE]':
-                                        break
-                                    
-                                    chunk = parse_chunk(data)
-                                    if chunk:
-                                        yield chunk
-                            except Exception as e:
-                                logger.error(f"Error processing chunk: {str(e)}")
-                                continue
-                else:
-                    # Process non-streaming response
-                    data = await response.json()
-                    if 'choices' in data and len(data['choices']) > 0:
-                        yield data['choices'][0]['message']['content']
-    
+        # Make request over the pooled connection
+        session = session or get_http_session()
+        async with session.post(api_url, json=payload, headers=headers) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                raise Exception(f"API request failed: {error_text}")
+            
+            if stream:
+                # Process streaming response; split raw bytes into SSE lines
+                # ourselves and hand each data payload straight to orjson
+                buffer = bytearray()
+                async for raw in response.content.iter_chunked(4096):
+                    buffer += raw
+                    *lines, tail = buffer.split(b"\n")
+                    buffer = bytearray(tail)
+                    for line in lines:
+                        if not line.startswith(b"data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == b"[DONE]":
+                            return
+                        try:
+                            choices = orjson.loads(data).get("choices")
+                        except orjson.JSONDecodeError:
+                            logger.error(f"Error processing chunk: {data[:100]!r}")
+                            continue
+                        if choices:
+                            content = choices[0].get("delta", {}).get("content")
+                            if content:
+                                yield content
+            else:
+                # Process non-streaming response
+                data = await response.json()
+                if 'choices' in data and len(data['choices']) > 0:
+                    yield data['choices'][0]['message']['content']
+
     except Exception as e:
         logger.error(f"Error in create_streaming_chat_completion: {str(e)}")
         raise
 
-def parse_chunk(data: str) -> str:
-    """
-    Parse a chunk of streaming data
-    
-    Args:
-        data: Raw chunk data
-        
-    Returns:
-        str: Parsed text content
-    """
-    try:
-        # Parse JSON data
-        chunk_data = json.loads(data)
-        
-        # Extract content from chunk
-        if 'choices' in chunk_data and len(chunk_data['choices']) > 0:
-            delta = chunk_data['choices'][0].get('delta', {})
-            return delta.get('content', '')
-        
-        return ''
-        
-    except Exception as e:
-        logger.error(f"Error parsing chunk: {str(e)}")
-        return ''
-
 def validate_sambanova_setup(api_key: str) -> bool:
     """
     Validate the SambaNova API setup
@@ -136,13 +352,20 @@ def validate_sambanova_setup(api_key: str) -> bool:
         
         # Test API connection with a simple completion
         test_messages = [{"role": "user", "content": "Test connection"}]
-        response = asyncio.run(create_streaming_chat_completion(
+        # Pull the first chunk on the persistent loop; asyncio.run would tear
+        # down the pooled session along with its loop
+        completion = create_streaming_chat_completion(
             messages=test_messages,
-            model="DeepSeek-R1-Distill-Llama-70B",
             temperature=0.7,
             max_tokens=10,
             stream=False
-        ))
+        )
+        try:
+            response = run_async(completion.__anext__())
+        except StopAsyncIteration:
+            response = None
+        finally:
+            run_async(completion.aclose())
         
         if response:
             logger.info("Successfully validated SambaNova API key")
@@ -1,111 +1,399 @@
-from transformers import BertTokenizer, BertModel
+from transformers import BertTokenizerFast, BertModel
 import torch
 from typing import List, Dict, Tuple, Any
 import numpy as np
 from loguru import logger
 import os
+import re
+from bisect import bisect_left
+import time
+import hashlib
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
 from qdrant_client.http.models import Distance, VectorParams
-from sentence_transformers import SentenceTransformer
-from sklearn.decomposition import PCA
 import plotly.graph_objects as go
 import networkx as nx
-from sklearn.cluster import KMeans
-from sklearn.metrics.pairwise import euclidean_distances
+from sklearn.cluster import KMeans, MiniBatchKMeans
 import uuid
 from sklearn.preprocessing import StandardScaler
-from sklearn.manifold import TSNE
 
-class VectorStore:
-    def __init__(self, n_segments=4, n_clusters=32):
-        qdrant_host = os.getenv("QDRANT_HOST", "localhost")
-        qdrant_port = int(os.getenv("QDRANT_PORT", 6333))
-        qdrant_https = os.getenv("QDRANT_HTTPS", "false").lower() == "true"
-        qdrant_url = f"https://{qdrant_host}" if qdrant_https else f"http://{qdrant_host}"
-        
-        self.client = QdrantClient(
-            url=qdrant_url,
-            port=qdrant_port,
-            timeout=30.0,
-            prefer_grpc=False,  # Use HTTP in App Runner
-            verify=False  # Skip SSL verification for internal VPC communication
-        )
-        # Initialize BERT
-        self.tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
+# int8 copies of the vectors stay in RAM for search; raw float32 vectors live on disk
+INT8_QUANTIZATION = models.ScalarQuantization(
+    scalar=models.ScalarQuantizationConfig(
+        type=models.ScalarType.INT8,
+        quantile=0.99,
+        always_ram=True
+    )
+)
+
+# 1 bit per dimension in RAM; QDRANT_QUANTIZATION=binary trades some recall for 32x less memory
+BINARY_QUANTIZATION = models.BinaryQuantization(
+    binary=models.BinaryQuantizationConfig(always_ram=True)
+)
+
+# Quantized candidates are re-ranked against the original vectors; 4x oversampling
+# recovers nearly all of the recall lost to int8 scoring
+RESCORE_SEARCH_PARAMS = models.SearchParams(
+    quantization=models.QuantizationSearchParams(rescore=True, oversampling=4.0)
+)
+
+# "bert" embeds in-process with torch; "fastembed" spreads ONNX inference across CPU cores
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "bert").lower()
+# 768-dim like bert-base, so collections and PQ segments are unchanged
+FASTEMBED_MODEL = os.getenv("FASTEMBED_MODEL", "BAAI/bge-base-en-v1.5")
+
+# On-disk cache of chunk embeddings keyed by content hash and embedding model
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "data/embedding_cache.db")
+
+# Dynamic int8 quantization of BERT's Linear layers for CPU inference; BERT_INT8=0 keeps float32
+BERT_INT8 = os.getenv("BERT_INT8", "1") == "1"
+# Half-precision BERT weights: fp16 on CUDA, bf16 on CPUs with native bf16 (when not int8); BERT_HALF=0 keeps float32
+BERT_HALF = os.getenv("BERT_HALF", "1") == "1"
+
+@lru_cache(maxsize=1)
+def _fastembed_model():
+    """Load the FastEmbed model once per process, or None if fastembed isn't installed"""
+    try:
+        from fastembed import TextEmbedding
+    except ImportError:
+        logger.warning("EMBED_BACKEND=fastembed but fastembed is not installed; using BERT")
+        return None
+    return TextEmbedding(model_name=FASTEMBED_MODEL, lazy_load=True)
+
+# Set bits in each byte value, for Hamming distances between packed bit codes
+_POPCOUNT_TABLE = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+@lru_cache(maxsize=1)
+def _pq_scan_kernel():
+    """Fused PQ scan, compiled on first search (or loaded from numba's disk cache), or None if numba isn't installed"""
+    try:
+        import numba
+    except ImportError:
+        return None
+    
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def pq_scan(codes, distance_table, out):
+        # One pass over the codes with the per-vector sum kept in a register
+        n_segments, n_vectors = codes.shape
+        for i in numba.prange(n_vectors):
+            total = 0.0
+            for m in range(n_segments):
+                total += distance_table[m, codes[m, i]]
+            out[i] = total
+    
+    return pq_scan
+
+def _quantization_config():
+    """Quantization for document chunk collections, selected by QDRANT_QUANTIZATION"""
+    if os.getenv("QDRANT_QUANTIZATION", "int8").lower() == "binary":
+        return BINARY_QUANTIZATION
+    return INT8_QUANTIZATION
+
+def create_qdrant_client() -> QdrantClient:
+    """Create a Qdrant client from the QDRANT_* environment variables"""
+    qdrant_host = os.getenv("QDRANT_HOST", "localhost")
+    qdrant_port = int(os.getenv("QDRANT_PORT", 6333))
+    qdrant_grpc_port = int(os.getenv("QDRANT_GRPC_PORT", 6334))
+    qdrant_https = os.getenv("QDRANT_HTTPS", "false").lower() == "true"
+    qdrant_url = f"https://{qdrant_host}" if qdrant_https else f"http://{qdrant_host}"
+    
+    return QdrantClient(
+        url=qdrant_url,
+        port=qdrant_port,
+        grpc_port=qdrant_grpc_port,
+        timeout=30.0,
+        prefer_grpc=not qdrant_https,  # gRPC locally, HTTP in App Runner
+        verify=False  # Skip SSL verification for internal VPC communication
+    )
+
+class BertEmbedder:
+    """BERT model, tokenizer and embedding caches; holds no per-document state, so one is shared process-wide"""
+    
+    def __init__(self):
+        # Initialize BERT; the Rust-backed tokenizer encodes a whole batch in one call
+        self.tokenizer = BertTokenizerFast.from_pretrained('bert-base-uncased')
         self.model = BertModel.from_pretrained('bert-base-uncased')
+        # Inference only: disable dropout once rather than per call
+        self.model.eval()
+        # Set device
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        weights = "fp32"
+        if self.device.type == "cpu" and BERT_INT8:
+            # int8 weights for the Linear layers; activations stay float32
+            self.model = torch.ao.quantization.quantize_dynamic(
+                self.model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+            weights = "int8"
+        elif self.device.type == "cuda" and BERT_HALF:
+            self.model = self.model.half()
+            weights = "fp16"
+        elif self.device.type == "cpu" and BERT_HALF and torch.backends.mkldnn.is_bf16_supported():
+            self.model = self.model.to(torch.bfloat16)
+            weights = "bf16"
+        self.model.to(self.device)
+        # Cache key for embeddings from this model; reduced-precision weights give slightly different vectors
+        self._bert_model_id = "bert-base-uncased:cls" + ("" if weights == "fp32" else f":{weights}")
+        self._embed_cache_lock = threading.Lock()
+        self._embed_cache = self._open_embed_cache()
+        # Memo for single texts (repeated chat queries); keyed by text only
+        self._embed_text_cached = lru_cache(maxsize=1024)(self._embed_text)
+
+    def get_word_embeddings(self, text: str) -> np.ndarray:
+        """Get BERT embeddings for text"""
+        inputs = self.tokenizer.encode_plus(
+            text,
+            add_special_tokens=True,
+            max_length=512,
+            padding=True,
+            truncation=True,
+            return_attention_mask=True,
+            return_tensors='pt'
+        ).to(self.device)
+        
+        with torch.inference_mode():
+            outputs = self.model(
+                inputs['input_ids'],
+                attention_mask=inputs['attention_mask']
+            )
+        
+        # Get [CLS] token embedding, back in float32 for PQ and Qdrant
+        embeddings = outputs.last_hidden_state[:, 0, :].float().cpu().numpy()
+        return embeddings[0]  # Return as 1D array
+
+    def _open_embed_cache(self):
+        """Open the on-disk embedding cache, or None if it can't be opened"""
+        try:
+            os.makedirs(os.path.dirname(EMBED_CACHE_PATH) or ".", exist_ok=True)
+            # Shared with the embedding thread pool; access is serialized by _embed_cache_lock
+            conn = sqlite3.connect(EMBED_CACHE_PATH, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunk_embeddings ("
+                "hash TEXT, model TEXT, vec BLOB, PRIMARY KEY (hash, model))"
+            )
+            conn.commit()
+            return conn
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache disabled: {str(e)}")
+            return None
+
+    def embed_batch(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        """Create embeddings for texts, reusing cached vectors and embedding only the misses"""
+        fastembed_model = _fastembed_model() if EMBED_BACKEND == "fastembed" else None
+        if self._embed_cache is None or not texts:
+            return self._embed_uncached(texts, fastembed_model, batch_size)
+        
+        model_id = f"fastembed:{FASTEMBED_MODEL}" if fastembed_model is not None else self._bert_model_id
+        keys = [hashlib.blake2b(text.encode(), digest_size=16).hexdigest() for text in texts]
+        
+        cached = {}
+        unique_keys = list(set(keys))
+        with self._embed_cache_lock:
+            # Stay under SQLite's host-parameter limit
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                cached.update(self._embed_cache.execute(
+                    f"SELECT hash, vec FROM chunk_embeddings WHERE model = ? AND hash IN ({','.join('?' * len(batch))})",
+                    [model_id, *batch]
+                ).fetchall())
+        
+        # Embed each distinct missing text once, even if it repeats within the batch
+        miss_keys = list(dict.fromkeys(key for key in keys if key not in cached))
+        if miss_keys:
+            first_index = {}
+            for i, key in enumerate(keys):
+                first_index.setdefault(key, i)
+            computed = self._embed_uncached([texts[first_index[key]] for key in miss_keys], fastembed_model, batch_size)
+            rows = [(key, model_id, vec.tobytes()) for key, vec in zip(miss_keys, computed)]
+            try:
+                with self._embed_cache_lock:
+                    self._embed_cache.executemany("INSERT OR IGNORE INTO chunk_embeddings VALUES (?, ?, ?)", rows)
+                    self._embed_cache.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to write embedding cache: {str(e)}")
+            cached.update((key, vec) for key, _, vec in rows)
+        
+        logger.debug(f"Embedding cache: {len(texts) - len(miss_keys)} hits, {len(miss_keys)} misses")
+        # Reassemble in input order as one contiguous float32 buffer
+        return np.ascontiguousarray(np.stack([np.frombuffer(cached[key], dtype=np.float32) for key in keys]))
+
+    def _embed_uncached(self, texts: List[str], fastembed_model, batch_size: int = 64) -> np.ndarray:
+        """Create [CLS] BERT embeddings for texts, one forward pass per batch"""
+        if fastembed_model is not None and texts:
+            # parallel=0 runs one worker per CPU core
+            return np.ascontiguousarray(
+                np.stack(list(fastembed_model.embed(texts, batch_size=256, parallel=0))),
+                dtype=np.float32
+            )
+        
+        embeddings = []
+        
+        with torch.inference_mode():
+            for start in range(0, len(texts), batch_size):
+                # Tokenize and encode the batch; padding is masked out by attention_mask
+                inputs = self.tokenizer(
+                    texts[start:start + batch_size],
+                    return_tensors="pt",
+                    max_length=512,
+                    padding=True,
+                    truncation=True
+                ).to(self.device)
+                
+                # Get BERT embeddings
+                outputs = self.model(**inputs)
+                
+                # Use [CLS] token embedding as text embedding, upcast from half precision
+                embeddings.append(outputs.last_hidden_state[:, 0, :].float().cpu().numpy())
+        
+        if not embeddings:
+            return np.empty((0, self.model.config.hidden_size), dtype=np.float32)
+        # One contiguous float32 buffer for PQ training and upserts
+        return np.ascontiguousarray(np.concatenate(embeddings), dtype=np.float32)
+
+    def get_embedding(self, text):
+        """Get BERT embedding for a text, reusing recent results for repeated texts"""
+        return np.frombuffer(self._embed_text_cached(text), dtype=np.float32).copy()
+
+    def _embed_text(self, text: str) -> bytes:
+        """Embed a single text as raw float32 bytes (immutable, so safe to memoize)"""
+        return self.embed_batch([text])[0].tobytes()
+
+@lru_cache(maxsize=1)
+def get_embedder() -> BertEmbedder:
+    """Load BERT once per process; every VectorStore embeds through it"""
+    return BertEmbedder()
+
+class VectorStore:
+    UPSERT_BATCH_SIZE = 512
+    MIN_CHUNK_CHARS = 32
+    MINIBATCH_KMEANS_MIN_VECTORS = 5000
+    # Corpora this large are shortlisted by Hamming distance before the PQ scan
+    BINARY_FILTER_MIN_VECTORS = 4096
+    BINARY_OVERSAMPLING = 4
+    
+    def __init__(self, n_segments=4, n_clusters=32, client: QdrantClient = None, embedder: BertEmbedder = None):
+        # Share a caller-provided client so several stores reuse one connection
+        self.client = client or create_qdrant_client()
+        # The model is shared; each store only holds its own document's chunks and PQ state
+        self.embedder = embedder or get_embedder()
         self.collection_name = "vector_embeddings"
         self._ensure_collection()
         self.n_segments = n_segments
         self.n_clusters = n_clusters
         self.segment_size = None
         self.codebooks = []
+        self._codebook_tensor = None
+        self._codebook_sq_norms = None
+        self._centroids_3d = None
         self.pq_codes = []
+        self._cluster_stats = None
+        self._bin_codes = None
+        self._bin_center = None
         self.chunks = []
-        
-        # Set device
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.model.to(self.device)
+        # The semantic cache collection is created on first use, once per store
+        self._semantic_cache_ready = False
         
         # Initialize scaler
         self.scaler = StandardScaler()
         
     def _ensure_collection(self):
-        """Ensure collection exists with correct settings"""
+        """Create the chunk collection if it doesn't exist; points other stores wrote are kept"""
         try:
-            # Try to get collection, recreate if it doesn't exist
-            try:
-                self.client.delete_collection(self.collection_name)
-                logger.info(f"Deleted existing collection: {self.collection_name}")
-            except Exception:
-                pass
-            
             self.client.create_collection(
                 collection_name=self.collection_name,
                 vectors_config=VectorParams(
                     size=768,  # BERT base hidden size
-                    distance=Distance.COSINE
-                )
+                    distance=Distance.COSINE,
+                    on_disk=True
+                ),
+                quantization_config=_quantization_config()
             )
             logger.info(f"Created collection: {self.collection_name}")
         except Exception as e:
-            logger.error(f"Error ensuring collection: {str(e)}")
-            raise
+            if "already exists" not in str(e):
+                logger.error(f"Error ensuring collection: {str(e)}")
+                raise
+        
+        # Chunk searches filter on the document they belong to
+        try:
+            self.client.create_payload_index(
+                collection_name=self.collection_name,
+                field_name="document_hash",
+                field_schema=models.PayloadSchemaType.KEYWORD
+            )
+        except Exception as e:
+            logger.warning(f"Could not index document_hash: {str(e)}")
+
+    @staticmethod
+    def point_ids(document_hash: str, n_points: int, start: int = 0) -> List[str]:
+        """Deterministic ids for a document's chunks; documents never collide and re-ingesting overwrites"""
+        return [str(uuid.uuid5(uuid.NAMESPACE_OID, f"{document_hash}:{i}")) for i in range(start, start + n_points)]
+
+    def chunk_text(self, text: str) -> List[str]:
+        """Split text into the same deduplicated chunks process_document embeds"""
+        return self._create_chunks(text)
 
     def _create_chunks(self, text: str, chunk_size: int = 256, overlap: int = 64) -> List[str]:
         """Create overlapping chunks from text"""
         chunks = []
+        seen = set()
         start = 0
         text_len = len(text)
+        
+        # Pick the chunk size up front: documents too short to give one chunk per
+        # cluster at the default size get smaller chunks, in a single pass
+        if text_len // (chunk_size - overlap) < self.n_clusters:
+            small_chunk_size = max(128, text_len // (self.n_clusters + 1))
+            if small_chunk_size < chunk_size:
+                chunk_size, overlap = small_chunk_size, 32
+        overlap = min(overlap, chunk_size // 2)
+        
+        # Offsets of every period and newline, found in one pass and then binary-searched,
+        # instead of rescanning each window for its last boundary
+        boundaries = [match.start() for match in re.finditer(r'[.\n]', text)]
 
         while start < text_len:
             end = start + chunk_size
             # Find the last period or newline before chunk_size
             if end < text_len:
-                last_period = text.rfind('.', start, end)
-                last_newline = text.rfind('\n', start, end)
-                end = max(last_period, last_newline) if max(last_period, last_newline) > -1 else end
+                i = bisect_left(boundaries, end) - 1
+                # A boundary inside the overlap would move the next chunk backwards
+                if i >= 0 and boundaries[i] > start + overlap:
+                    end = boundaries[i]
             
             chunk = text[start:end].strip()
-            if chunk:  # Only add non-empty chunks
+            # Skip near-empty fragments and exact repeats (e.g. PDF headers/footers)
+            # so they are never embedded or stored
+            if len(chunk) >= self.MIN_CHUNK_CHARS and chunk not in seen:
+                seen.add(chunk)
                 chunks.append(chunk)
+            if end >= text_len:
+                break
             start = end - overlap
             
-        # Ensure we have enough chunks for meaningful visualization
-        if len(chunks) < self.n_clusters:
-            # Create smaller chunks if needed
-            new_chunk_size = max(128, len(text) // (self.n_clusters + 1))
-            return self._create_chunks(text, chunk_size=new_chunk_size, overlap=32)
-            
         return chunks
 
-    def process_document(self, content: str):
-        """Process document content into chunks and vectors"""
+    def process_document(self, content: str, store: bool = True, document_hash: str = None):
+        """Process document content into chunks and vectors, upserting them unless store is False
+
+        Stored chunks are tagged with document_hash (by default a hash of the
+        content) so search_chunks can stay within one document.
+        """
         try:
             # Clear existing data
             self.chunks = []
             self.codebooks = []
+            self._codebook_tensor = None
+            self._codebook_sq_norms = None
+            self._centroids_3d = None
             self.pq_codes = []
+            self._cluster_stats = None
+            self._bin_codes = None
+            self._bin_center = None
             
             # Chunk the document
             self.chunks = self._create_chunks(content)
@@ -115,21 +403,19 @@ class VectorStore:
             vectors = self._create_embeddings(self.chunks)
             logger.info(f"Created embeddings with shape: {vectors.shape}")
             
-            # Store chunks and vectors in Qdrant
-            points = []
-            for i, (chunk, vector) in enumerate(zip(self.chunks, vectors)):
-                points.append(models.PointStruct(
-                    id=i,
-                    vector=vector.tolist(),
-                    payload={"text": chunk}
-                ))
-            
-            if points:
-                self.client.upsert(
+            # Store chunks and vectors in Qdrant straight from the contiguous
+            # float32 array, without building a PointStruct per chunk
+            if store and len(self.chunks):
+                document_hash = document_hash or hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+                self.client.upload_collection(
                     collection_name=self.collection_name,
-                    points=points
+                    vectors=vectors,
+                    payload=[{"text": chunk, "document_hash": document_hash} for chunk in self.chunks],
+                    ids=self.point_ids(document_hash, len(self.chunks)),
+                    batch_size=self.UPSERT_BATCH_SIZE,
+                    parallel=4
                 )
-                logger.info(f"Stored {len(points)} points in Qdrant")
+                logger.info(f"Stored {len(self.chunks)} points in Qdrant")
             
             return self.chunks, vectors
             
@@ -137,114 +423,206 @@ class VectorStore:
             logger.error(f"Error processing document: {str(e)}")
             raise
 
-    def _split_vector(self, vector: np.ndarray) -> List[np.ndarray]:
-        """Split vector into M segments"""
-        return np.array_split(vector, self.n_segments)
-    
+    def create_bulk_collection(self, collection_name: str) -> None:
+        """(Re)create a quantized named-vector collection with HNSW indexing deferred for bulk ingest"""
+        self.client.recreate_collection(
+            collection_name=collection_name,
+            vectors_config={
+                "vectors": VectorParams(
+                    size=768,
+                    distance=Distance.COSINE,
+                    on_disk=True
+                )
+            },
+            hnsw_config=models.HnswConfigDiff(m=0),
+            optimizers_config=models.OptimizersConfigDiff(indexing_threshold=0),
+            quantization_config=_quantization_config()
+        )
+
+    def build_index(self, collection_name: str, m: int = 16, indexing_threshold: int = 10000) -> None:
+        """Re-enable HNSW indexing once a bulk ingest has finished"""
+        self.client.update_collection(
+            collection_name=collection_name,
+            hnsw_config=models.HnswConfigDiff(m=m),
+            optimizers_config=models.OptimizersConfigDiff(indexing_threshold=indexing_threshold)
+        )
+
+    def bulk_upload(self, collection_name: str, vectors: np.ndarray, payloads: List[dict]) -> None:
+        """Upload named vectors straight from a float32 matrix, in parallel batches"""
+        # Pair rows with payloads like zip() would if the two lengths differ
+        n_points = min(len(vectors), len(payloads))
+        self.client.upload_collection(
+            collection_name=collection_name,
+            vectors={"vectors": np.ascontiguousarray(vectors[:n_points], dtype=np.float32)},
+            payload=payloads[:n_points],
+            ids=range(n_points),
+            batch_size=self.UPSERT_BATCH_SIZE,
+            parallel=4,
+            # Callers rebuild the index and report success once this returns
+            wait=True
+        )
+
     def train_product_quantizer(self, vectors: np.ndarray):
         """Train Product Quantizer on the dataset"""
         n_vectors, dim = vectors.shape
         self.segment_size = dim // self.n_segments
         
-        # Split vectors into segments
+        # Split vectors into contiguous float32 segments so sklearn doesn't copy or upcast
         segments = []
         for i in range(self.n_segments):
             start = i * self.segment_size
             end = start + self.segment_size if i < self.n_segments - 1 else dim
-            segments.append(vectors[:, start:end])
+            segments.append(np.ascontiguousarray(vectors[:, start:end], dtype=np.float32))
         
-        # Train k-means for each segment
-        self.codebooks = []
-        for segment_vectors in segments:
-            kmeans = KMeans(n_clusters=self.n_clusters, random_state=42)
-            kmeans.fit(segment_vectors)
-            self.codebooks.append(kmeans)
+        def fit_segment(segment_vectors):
+            # Full-batch k-means is exact but scales with every vector per iteration;
+            # large corpora are fitted on mini-batches instead
+            if n_vectors >= self.MINIBATCH_KMEANS_MIN_VECTORS:
+                kmeans = MiniBatchKMeans(
+                    n_clusters=self.n_clusters, random_state=42,
+                    batch_size=1024, n_init=3, max_iter=50
+                )
+            else:
+                # Elkan's triangle-inequality bounds skip most distance computations for
+                # few clusters in low dimensions; with a fixed seed one init is enough
+                kmeans = KMeans(
+                    n_clusters=self.n_clusters, random_state=42,
+                    n_init=1, algorithm='elkan', tol=1e-3
+                )
+            return kmeans.fit(segment_vectors)
+        
+        # Train k-means for each segment; fits are independent and BLAS releases the GIL
+        self._codebook_tensor = None
+        self._codebook_sq_norms = None
+        self._centroids_3d = None
+        self._cluster_stats = None
+        with ThreadPoolExecutor(max_workers=self.n_segments) as pool:
+            self.codebooks = list(pool.map(fit_segment, segments))
+
+    @property
+    def codebook_tensor(self) -> np.ndarray:
+        """Codebook centroids stacked as (n_segments, n_clusters, segment_size)"""
+        if self._codebook_tensor is None and self.codebooks:
+            self._codebook_tensor = np.stack([codebook.cluster_centers_ for codebook in self.codebooks])
+        return self._codebook_tensor
+
+    @property
+    def codebook_sq_norms(self) -> np.ndarray:
+        """Squared norm of every centroid as (n_segments, n_clusters), computed once per training"""
+        if self._codebook_sq_norms is None and self.codebooks:
+            centers = self.codebook_tensor
+            self._codebook_sq_norms = np.einsum('mkd,mkd->mk', centers, centers)
+        return self._codebook_sq_norms
+
+    @property
+    def centroids_3d(self) -> np.ndarray:
+        """All centroids projected into one shared 3D PCA space, as (n_segments * n_clusters, 3)"""
+        if self._centroids_3d is None and self.codebooks:
+            # Place each centroid at its own segment's coordinates (zeros elsewhere) so
+            # every segment is projected onto the same axes by a single SVD
+            centers = self.codebook_tensor
+            n_segments, n_clusters, segment_size = centers.shape
+            padded = np.einsum('mn,mkd->mknd', np.eye(n_segments, dtype=centers.dtype), centers)
+            self._centroids_3d = self._project_3d(
+                padded.reshape(n_segments * n_clusters, n_segments * segment_size)
+            )
+        return self._centroids_3d
+
+    @property
+    def cluster_stats(self) -> Tuple[np.ndarray, List[List[np.ndarray]]]:
+        """Per-centroid usage counts (n_segments, n_clusters) and up to 3 sample vector ids per centroid"""
+        if self._cluster_stats is None and len(self.pq_codes):
+            codes = np.asarray(self.pq_codes)
+            usage = np.stack([np.bincount(row, minlength=self.n_clusters) for row in codes])
+            samples = []
+            for row, counts in zip(codes, usage):
+                # A stable sort groups ids by centroid in ascending order; each group's
+                # first three ids are the samples
+                order = np.argsort(row, kind='stable')
+                starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+                samples.append([order[start:start + min(count, 3)] for start, count in zip(starts, counts)])
+            self._cluster_stats = (usage, samples)
+        return self._cluster_stats
+
+    def reconstruct_vectors(self) -> np.ndarray:
+        """Reconstruct full vectors from PQ codes"""
+        codes = np.asarray(self.pq_codes)
+        # (n_segments, n_vectors, segment_size) -> (n_vectors, dim)
+        segments = self.codebook_tensor[np.arange(self.n_segments)[:, None], codes]
+        return segments.transpose(1, 0, 2).reshape(codes.shape[1], -1)
             
     def encode_vectors(self, vectors: np.ndarray) -> np.ndarray:
-        """Encode vectors using trained product quantizer"""
+        """Encode vectors as (n_segments, n_vectors) codes, one contiguous row per segment"""
         n_vectors = len(vectors)
-        codes = np.zeros((n_vectors, self.n_segments), dtype=np.int32)
+        # Cluster ids fit in a byte for up to 256 clusters
+        code_dtype = np.uint8 if self.n_clusters <= 256 else np.uint16
+        codes = np.zeros((self.n_segments, n_vectors), dtype=code_dtype)
         
         for m in range(self.n_segments):
             start = m * self.segment_size
             end = start + self.segment_size if m < self.n_segments - 1 else vectors.shape[1]
             segment_vectors = vectors[:, start:end]
-            codes[:, m] = self.codebooks[m].predict(segment_vectors)
+            codes[m] = self.codebooks[m].predict(segment_vectors)
             
         return codes
     
     def compute_distance_table(self, query: np.ndarray) -> np.ndarray:
-        """Compute distance table for query vector"""
-        distance_table = np.zeros((self.n_segments, self.n_clusters))
-        query_segments = self._split_vector(query)
-        
-        for m, (q_segment, codebook) in enumerate(zip(query_segments, self.codebooks)):
-            distance_table[m] = euclidean_distances(
-                q_segment.reshape(1, -1),
-                codebook.cluster_centers_
-            )[0]
-            
-        return distance_table
+        """Compute squared distances from each query segment to every centroid of its segment"""
+        # ||q - c||^2 = ||q||^2 + ||c||^2 - 2 q.c, with all segments in one batched product
+        centers = self.codebook_tensor
+        q = np.asarray(query, dtype=centers.dtype).reshape(self.n_segments, -1)
+        dots = np.einsum('md,mkd->mk', q, centers)
+        distance_table = (q * q).sum(axis=1, keepdims=True) + self.codebook_sq_norms - 2 * dots
+        # Rounding can push exact matches slightly below zero
+        return np.maximum(distance_table, 0)
     
     def approximate_nearest_neighbor(self, query: np.ndarray, k: int = 5) -> List[Tuple[int, float]]:
-        """Find approximate nearest neighbors using PQ"""
+        """Find approximate nearest neighbors using PQ, shortlisting by Hamming distance on large corpora"""
+        codes = np.asarray(self.pq_codes)
+        k = min(k, codes.shape[1] if codes.ndim == 2 else 0)
+        if k == 0:
+            return []
+        
+        # Stage 1: rank by Hamming distance between packed sign bits and keep an
+        # oversampled shortlist; only the shortlist's PQ codes are scanned below
+        candidates = None
+        if self._bin_codes is not None and codes.shape[1] >= self.BINARY_FILTER_MIN_VECTORS:
+            query_bits = np.packbits(np.asarray(query) > self._bin_center)
+            hamming = _POPCOUNT_TABLE[np.bitwise_xor(self._bin_codes, query_bits)].sum(axis=1, dtype=np.uint32)
+            n_candidates = min(self.BINARY_OVERSAMPLING * k, len(hamming))
+            candidates = np.argpartition(hamming, n_candidates - 1)[:n_candidates]
+            codes = np.ascontiguousarray(codes[:, candidates])
+        
         distance_table = self.compute_distance_table(query)
         
-        # Compute approximate distances
-        distances = np.zeros(len(self.pq_codes))
-        for i, code in enumerate(self.pq_codes):
-            distances[i] = sum(distance_table[m, c] for m, c in enumerate(code))
-            
-        # Get top k nearest neighbors
-        nearest_idx = np.argsort(distances)[:k]
-        return [(idx, distances[idx]) for idx in nearest_idx]
+        # Compute approximate distances: each segment is a table lookup over its
+        # own contiguous row of codes, accumulated in place
+        distances = np.zeros(codes.shape[1], dtype=distance_table.dtype)
+        pq_scan = _pq_scan_kernel()
+        if pq_scan is not None:
+            pq_scan(codes, distance_table, distances)
+        else:
+            for m in range(self.n_segments):
+                distances += distance_table[m][codes[m]]
+            
+        # Get top k nearest neighbors without sorting every distance
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.argsort(distances[nearest])]
+        if candidates is None:
+            return [(idx, distances[idx]) for idx in nearest]
+        return [(candidates[idx], distances[idx]) for idx in nearest]
     
     def get_word_embeddings(self, text: str) -> np.ndarray:
         """Get BERT embeddings for text"""
-        inputs = self.tokenizer.encode_plus(
-            text,
-            add_special_tokens=True,
-            max_length=512,
-            padding='max_length',
-            truncation=True,
-            return_attention_mask=True,
-            return_tensors='pt'
-        )
-        
-        with torch.no_grad():
-            outputs = self.model(
-                inputs['input_ids'],
-                attention_mask=inputs['attention_mask']
-            )
-        
-        # Get [CLS] token embedding
-        embeddings = outputs.last_hidden_state[:, 0, :].numpy()
-        return embeddings[0]  # Return as 1D array
+        return self.embedder.get_word_embeddings(text)
+
+    def embed_batch(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        """Create embeddings for texts, reusing cached vectors"""
+        return self.embedder.embed_batch(texts, batch_size)
 
     def _create_embeddings(self, chunks: List[str]) -> np.ndarray:
         """Create BERT embeddings for text chunks"""
-        embeddings = []
-        
-        with torch.no_grad():
-            for chunk in chunks:
-                # Tokenize and encode the chunk
-                inputs = self.tokenizer(
-                    chunk,
-                    return_tensors="pt",
-                    max_length=512,
-                    padding=True,
-                    truncation=True
-                ).to(self.device)
-                
-                # Get BERT embeddings
-                outputs = self.model(**inputs)
-                
-                # Use [CLS] token embedding as chunk embedding
-                embedding = outputs.last_hidden_state[0, 0, :].cpu().numpy()
-                embeddings.append(embedding)
-        
-        # Convert to numpy array
-        embeddings_array = np.array(embeddings)
+        embeddings_array = self.embed_batch(chunks)
         
         # Train product quantizer if not already trained
         if not self.codebooks:
@@ -252,6 +630,12 @@ class VectorStore:
         
         # Encode vectors using product quantization
         self.pq_codes = self.encode_vectors(embeddings_array)
+        self._cluster_stats = None
+        
+        # 1 bit per dimension for the Hamming pre-filter; thresholding at the corpus
+        # mean rather than zero keeps the bits balanced for uncentered BERT vectors
+        self._bin_center = embeddings_array.mean(axis=0)
+        self._bin_codes = np.packbits(embeddings_array > self._bin_center, axis=1)
         
         return embeddings_array
 
@@ -298,8 +682,10 @@ class VectorStore:
                 collection_name="chat_responses",
                 vectors_config=VectorParams(
                     size=768,  # Assuming BERT base hidden size
-                    distance=Distance.COSINE
-                )
+                    distance=Distance.COSINE,
+                    on_disk=True
+                ),
+                quantization_config=INT8_QUANTIZATION
             )
             logger.info("Created chat_responses collection.")
         except Exception as e:
@@ -307,85 +693,141 @@ class VectorStore:
                 logger.error(f"Error ensuring chat_responses collection: {str(e)}")
                 raise
 
-    def get_embedding(self, text):
-        """Get BERT embedding for a text"""
-        # Tokenize and prepare for model
-        inputs = self.tokenizer(
-            text, 
-            return_tensors="pt", 
-            max_length=512, 
-            truncation=True, 
-            padding=True
+    # Keyed by sentence embeddings (all-MiniLM-L6-v2, mean pooled), not BERT [CLS]
+    # vectors, whose anisotropy puts unrelated short questions above any useful threshold
+    SEMANTIC_CACHE_COLLECTION = "semantic_cache_minilm"
+
+    def _ensure_semantic_cache_collection(self, size: int):
+        """Ensure the semantic cache collection exists, at most once per store"""
+        if self._semantic_cache_ready:
+            return
+        try:
+            self.client.create_collection(
+                collection_name=self.SEMANTIC_CACHE_COLLECTION,
+                vectors_config=VectorParams(
+                    size=size,
+                    distance=Distance.COSINE,
+                    on_disk=True
+                ),
+                quantization_config=INT8_QUANTIZATION
+            )
+            logger.info(f"Created {self.SEMANTIC_CACHE_COLLECTION} collection.")
+        except Exception as e:
+            if "already exists" not in str(e):
+                logger.error(f"Error ensuring {self.SEMANTIC_CACHE_COLLECTION} collection: {str(e)}")
+                raise
+        self._semantic_cache_ready = True
+
+    def search_chunks(self, query: str, document_hash: str, limit: int = 5) -> List[str]:
+        """Return the text of one document's stored chunks most similar to a query"""
+        # Embed the query exactly as the chunks were embedded at ingest
+        query_vector = self.embed_batch([query])[0]
+        hits = self.client.search(
+            collection_name=self.collection_name,
+            query_vector=query_vector,
+            query_filter=models.Filter(must=[
+                models.FieldCondition(key="document_hash", match=models.MatchValue(value=document_hash))
+            ]),
+            limit=limit,
+            search_params=RESCORE_SEARCH_PARAMS
+        )
+        return [hit.payload["text"] for hit in hits]
+
+    def lookup_cached_response(self, query_embedding: np.ndarray, model: str, context_key: str,
+                               threshold: float = 0.92, ttl_seconds: int = 3600) -> str:
+        """Return a fresh cached response for a near-duplicate query, or None
+
+        Only entries with the same context_key (a hash of everything sent
+        besides the query, e.g. system prompt, history and sampling
+        parameters) can match.
+        """
+        self._ensure_semantic_cache_collection(len(query_embedding))
+        hits = self.client.search(
+            collection_name=self.SEMANTIC_CACHE_COLLECTION,
+            query_vector=query_embedding,
+            query_filter=models.Filter(must=[
+                models.FieldCondition(key="model", match=models.MatchValue(value=model)),
+                models.FieldCondition(key="context_key", match=models.MatchValue(value=context_key)),
+                models.FieldCondition(key="created_at", range=models.Range(gte=time.time() - ttl_seconds))
+            ]),
+            limit=1,
+            score_threshold=threshold,
+            search_params=RESCORE_SEARCH_PARAMS
+        )
+        if not hits:
+            return None
+        logger.info(f"Semantic cache hit (score {hits[0].score:.3f})")
+        return hits[0].payload["response"]
+
+    def cache_response(self, query_embedding: np.ndarray, response: str, model: str, context_key: str):
+        """Store a response in the semantic cache"""
+        self._ensure_semantic_cache_collection(len(query_embedding))
+        self.client.upsert(
+            collection_name=self.SEMANTIC_CACHE_COLLECTION,
+            points=[models.PointStruct(
+                id=str(uuid.uuid4()),
+                vector=query_embedding.tolist(),
+                payload={
+                    "response": response,
+                    "created_at": time.time(),
+                    "model": model,
+                    "context_key": context_key
+                }
+            )]
         )
-        
-        # Get model output
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-            
-        # Use CLS token embedding as text representation
-        embedding = outputs.last_hidden_state[0, 0, :].numpy()
-        return embedding
+
+    def get_embedding(self, text):
+        """Get BERT embedding for a text, reusing recent results for repeated texts"""
+        return self.embedder.get_embedding(text)
+
+    @staticmethod
+    def _project_3d(centers: np.ndarray) -> np.ndarray:
+        """Project centroids onto their first three principal components (float32 SVD)"""
+        X = np.array(centers, dtype=np.float32)
+        X -= X.mean(axis=0)
+        U, S, _ = np.linalg.svd(X, full_matrices=False)
+        return U[:, :3] * S[:3]
 
     def create_interactive_graph(self) -> go.Figure:
         """Create visualization using PQ-encoded vectors"""
         try:
-            points = self.client.scroll(
-                collection_name=self.collection_name,
-                limit=1000
-            )[0]
-            
-            if not points:
+            if not len(self.pq_codes):
                 return self._create_fallback_visualization()
             
-            # Get unique centroids from each segment
-            centroids_3d = []
-            chunk_texts = {}  # Store texts for each cluster
+            # Usage counts, sample ids and the 3D projection are cached per document
+            usage, samples = self.cluster_stats
+            centroids_3d = self.centroids_3d
             
-            for m, codebook in enumerate(self.codebooks):
-                centers = codebook.cluster_centers_
-                pca = PCA(n_components=3)
-                segment_centroids = pca.fit_transform(centers)
-                centroids_3d.extend(segment_centroids)
-                
-                # Group texts by cluster
-                for i, code in enumerate(self.pq_codes[:, m]):
-                    cluster_key = f"{m}_{code}"
-                    if cluster_key not in chunk_texts:
-                        chunk_texts[cluster_key] = []
-                    if i < len(points):
-                        chunk_texts[cluster_key].append(points[i].payload["text"])
-            
-            centroids_3d = np.array(centroids_3d)
+            # Sample texts come from this store's own chunks, which line up with the
+            # PQ codes whether or not the document was also stored in Qdrant
+            texts = self.chunks
+            if not texts:
+                return self._create_fallback_visualization()
             
             # Create graph
             G = nx.Graph()
             
-            # Add nodes for each significant centroid
-            for i, pos in enumerate(centroids_3d):
-                segment = i // self.n_clusters
-                cluster = i % self.n_clusters
-                cluster_key = f"{segment}_{cluster}"
+            # Add nodes for each centroid in use
+            for segment, cluster in zip(*np.nonzero(usage)):
+                usage_count = int(usage[segment, cluster])
                 
-                # Count vectors using this centroid
-                usage_count = np.sum(self.pq_codes[:, segment] == cluster)
+                # Get sample texts for this cluster
+                cluster_texts = [texts[idx] for idx in samples[segment][cluster].tolist()]
+                sample_text = "<br>".join([
+                    f"Sample {j+1}: {text[:100]}..."
+                    for j, text in enumerate(cluster_texts)
+                ])
                 
-                if usage_count > 0:
-                    # Get sample texts for this cluster
-                    cluster_samples = chunk_texts.get(cluster_key, [])
-                    sample_text = "<br>".join([
-                        f"Sample {j+1}: {text[:100]}..." 
-                        for j, text in enumerate(cluster_samples[:3])
-                    ])
-                    
-                    hover_text = (
-                        f"Segment {segment}, Cluster {cluster}<br>"
-                        f"Used by {usage_count} vectors<br><br>"
-                        f"Text Samples:<br>{sample_text}"
-                    )
-                    
-                    G.add_node(i, pos=tuple(pos), 
-                             text=hover_text,
-                             size=usage_count)
+                hover_text = (
+                    f"Segment {segment}, Cluster {cluster}<br>"
+                    f"Used by {usage_count} vectors<br><br>"
+                    f"Text Samples:<br>{sample_text}"
+                )
+                
+                i = segment * self.n_clusters + cluster
+                G.add_node(i, pos=tuple(centroids_3d[i]),
+                         text=hover_text,
+                         size=usage_count)
             
             # Create figure
             fig = go.Figure()
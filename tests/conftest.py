@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Make the `src` package importable when pytest is run from the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
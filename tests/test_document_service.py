@@ -0,0 +1,91 @@
+import random
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+from src.services.document_service import DocumentService
+
+
+class WhitespaceTokenizer:
+    """One token per whitespace-separated word, with stable ids"""
+
+    def __init__(self):
+        self.vocab = {}
+
+    def encode(self, text, add_special_tokens=False):
+        return [self.vocab.setdefault(word, len(self.vocab)) for word in text.split()]
+
+    def num_special_tokens_to_add(self):
+        return 2
+
+
+def make_service(chunk_size=12, chunk_overlap=3):
+    """A DocumentService with a stub tokenizer and no model or disk cache"""
+    service = DocumentService.__new__(DocumentService)
+    service.tokenizer = WhitespaceTokenizer()
+    service.chunk_size = chunk_size
+    service.chunk_overlap = chunk_overlap
+    service._cache = None
+    service._cache_lock = threading.Lock()
+    service._token_cache = OrderedDict()
+    service.token_cache_size = 32
+    return service
+
+
+def make_text(n_words, seed=0):
+    """Words of varying length joined by mixed whitespace"""
+    rng = random.Random(seed)
+    separators = [" ", "  ", "\n", "\t", " \n "]
+    words = [f"w{i}" + "x" * rng.randint(0, 12) for i in range(n_words)]
+    return "".join(word + rng.choice(separators) for word in words)
+
+
+# With chunk_size=12 and 2 special tokens, windows hold 10 tokens and advance by 7
+@pytest.mark.parametrize("n_words", [0, 1, 9, 10, 11, 13, 17, 24, 100, 1000])
+@pytest.mark.parametrize("block_size", [1, 5, 16, 64, 1 << 20])
+def test_streamed_chunks_match_whole_text(tmp_path, n_words, block_size):
+    text = make_text(n_words, seed=n_words)
+    path = tmp_path / "doc.txt"
+    path.write_text(text, encoding="utf-8")
+    service = make_service()
+
+    streamed = list(service._iter_chunks(str(path), block_size=block_size))
+
+    assert streamed == service._tokenize_into_chunks(text)
+
+
+@pytest.mark.parametrize("n_words", [0, 5, 10, 17, 250])
+def test_file_chunks_rebuild_the_token_stream_for_the_cache(tmp_path, n_words):
+    text = make_text(n_words, seed=n_words)
+    path = tmp_path / "doc.txt"
+    path.write_text(text, encoding="utf-8")
+    service = make_service()
+
+    first = list(service._iter_file_chunks(str(path)))
+    cached = service._token_cache[service._file_hash(str(path))]
+    second = list(service._iter_file_chunks(str(path)))
+
+    assert cached.tolist() == service.tokenizer.encode(text)
+    assert first == second == service._tokenize_into_chunks(text)
+
+
+def test_windows_overlap_and_cover_every_token():
+    service = make_service(chunk_size=12, chunk_overlap=3)
+    tokens = np.arange(30, dtype=np.int32)
+
+    windows = [window.tolist() for window in service._windows(tokens)]
+
+    assert all(len(window) <= 10 for window in windows)
+    for previous, current in zip(windows, windows[1:]):
+        assert previous[-3:] == current[:3]
+    assert windows[-1][-1] == 29
+    assert sorted(set(token for window in windows for token in window)) == list(range(30))
+
+
+def test_windows_of_a_short_stream_is_one_window():
+    service = make_service()
+
+    assert [window.tolist() for window in service._windows(np.arange(4, dtype=np.int32))] == [[0, 1, 2, 3]]
+    assert list(service._windows(np.empty(0, dtype=np.int32))) == []
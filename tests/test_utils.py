@@ -0,0 +1,105 @@
+import re
+
+import numpy as np
+import pytest
+
+from src import utils
+from src.utils import create_document_splits, trim_history
+
+
+def token_starts(text):
+    """Start offset of each whitespace-separated word"""
+    return np.asarray([match.start() for match in re.finditer(r"\S+", text)], dtype=np.int32)
+
+
+class WhitespaceTokenizer:
+    """Batch tokenizer returning one id per whitespace-separated word"""
+
+    def __call__(self, texts, **kwargs):
+        return {"input_ids": [text.split() for text in texts]}
+
+
+@pytest.fixture(autouse=True)
+def stub_tokenizer(monkeypatch):
+    monkeypatch.setattr(utils, "get_bert_tokenizer", lambda: WhitespaceTokenizer())
+
+
+# create_document_splits
+
+@pytest.mark.parametrize("max_tokens", [1, 3, 7, 50, 1000])
+def test_splits_cover_the_text_within_the_token_budget(max_tokens):
+    text = "Alpha beta gamma. Delta epsilon\nzeta eta.\n\nTheta iota kappa lambda mu. " * 20
+    starts = token_starts(text)
+
+    splits = create_document_splits(text, starts, max_tokens)
+
+    assert "".join(split["content"] for split in splits) == text
+    assert all(0 < split["tokens"] <= max_tokens for split in splits)
+    assert sum(split["tokens"] for split in splits) == len(starts)
+    for previous, current in zip(splits, splits[1:]):
+        assert previous["end"] == current["start"]
+
+
+def test_split_prefers_a_paragraph_break():
+    text = "one two three\n\nfour five six seven"
+    splits = create_document_splits(text, token_starts(text), 5)
+
+    assert splits[0]["content"] == "one two three\n\n"
+    assert splits[0]["tokens"] == 3
+
+
+def test_short_text_is_one_split():
+    text = "just a few words"
+    splits = create_document_splits(text, token_starts(text), 100)
+
+    assert splits == [{"start": 0, "end": len(text), "tokens": 4, "content": text}]
+
+
+def test_empty_text_has_no_splits():
+    assert create_document_splits("", np.empty(0, dtype=np.int32), 10) == []
+
+
+# trim_history
+
+def message(role, content):
+    return {"role": role, "content": content}
+
+
+def test_keeps_system_and_newest_messages_within_budget():
+    messages = [
+        message("system", "be brief"),
+        message("user", "one two three"),
+        message("assistant", "four five"),
+        message("user", "six seven"),
+        message("assistant", "eight"),
+        message("user", "nine ten"),
+    ]
+
+    trimmed = trim_history(messages, max_tokens=5)
+
+    assert trimmed == [messages[0], *messages[3:]]
+
+
+def test_new_user_turn_is_kept_even_over_budget():
+    messages = [message("user", "old"), message("user", "a b c d e f")]
+
+    assert trim_history(messages, max_tokens=2) == [messages[-1]]
+
+
+def test_system_message_alone():
+    assert trim_history([message("system", "hi")]) == [message("system", "hi")]
+
+
+def test_code_indentation_survives():
+    code = "```python\ndef f(x):\n    if x:\n        return  x\n```"
+    messages = [message("assistant", code), message("user", "    indented first line")]
+
+    trimmed = trim_history(messages)
+
+    assert [m["content"] for m in trimmed] == [code, "    indented first line"]
+
+
+def test_trailing_whitespace_and_blank_line_runs_are_removed():
+    messages = [message("user", "\n\nfirst line   \n \n\n\n\nsecond\t\n\n")]
+
+    assert trim_history(messages)[0]["content"] == "first line\n\nsecond"